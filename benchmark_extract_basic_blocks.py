@@ -0,0 +1,234 @@
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+from extract_basic_blocks import (basic_blocks_from_transitions, build_asm_index, count_file_transitions, export_basic_blocks,
+                                  export_basic_blocks_db, extract_asm_from_index, find_trace_files, link_trace_transitions)
+
+# Synthetic traces in the layouts extract_basic_blocks.py reads: name -> (file name, header, delimiter, pc index, index
+# of the branch target or assembly). The indices match the ones used for -tp, -ti and -ta.
+TRACE_LAYOUTS = {
+    "tp": ("perf_trace_{}.csv", "pc|br_target", '|', 0, 1),
+    "ti": ("instr_trace_{}.txt", "pc,code,assembly,imm,rs1_data,rs2_data,rd_data,jump_pc,csr,csr_reg,mem_addr", ',', 0, 7),
+    "ta": ("asm_trace_{}.txt", "pc;assembly", ';', 0, 1),
+}
+TI_ASM_IDX = 2
+# benchmarked pipelines: name -> (layout the basic blocks are counted in, layout the assembly is read from)
+PIPELINES = {
+    "ti": ("ti", "ti"),
+    "tp": ("tp", "ta"),
+}
+# counting is the single pass over the traces (transitions of each pc), discovery finds the leaders and block counts in them
+STAGES = ("counting", "discovery", "asm", "export")
+BASE_ADDRESS = 0x80000000
+
+def generate_program(blocks, branch_density, seed=0):
+    """ Lays out a synthetic program of basic blocks [(start, instructions)], every block ends with a branch. On average
+        one in 1 / branch_density instructions is a branch. Some blocks are separated by gaps of unexecuted code. """
+    rng = random.Random(seed)
+    max_length = max(1, round(2 / branch_density) - 1)
+    program = []
+    pc = BASE_ADDRESS
+    for _ in range(blocks):
+        length = rng.randint(1, max_length)
+        program.append((pc, length))
+        pc += 4 * (length + rng.choice((0, 0, 0, 2)))
+    return program
+
+def instruction_asm(pc, branch):
+    """ Assembly of a synthetic instruction in the format of the simulator ('name # [operands]') """
+    reg = (pc >> 2) % 31 + 1
+    if branch:
+        return f"bne # [x{reg} | x{reg % 31 + 1} | {(pc >> 4) & 0xff}]"
+    return f"addi # [x{reg} | x{reg % 31 + 1} | {(pc >> 2) & 0x7ff}]"
+
+def format_row(layout, pc, br_target, asm):
+    target = '-' if br_target is None else f"{br_target:x}"
+    if layout == "tp":
+        return f"{pc:x}|{target}"
+    if layout == "ti":
+        return f"{pc:x},{pc & 0xffffffff:08x},{asm},0,0,0,0,{target},,,"
+    return f"{pc:x};{asm}"
+
+def generate_traces(path, layouts, program, instructions, files=1, taken=0.5, seed=0):
+    """ Simulates a random walk over the blocks of the program and writes its trace in each layout to path/<layout>,
+        split into files chunks of (about) equal size. A branch jumps to a random block with probability taken, else falls
+        through. Returns the number of instructions written. """
+    rng = random.Random(seed)
+    # the rows of a block only depend on its successor, so they are formatted once per (block, successor)
+    block_rows = {}
+    def rows_of(block, successor):
+        if (block, successor) not in block_rows:
+            start, length = program[block]
+            target = program[successor][0]
+            rows = []
+            for layout in layouts:
+                lines = [format_row(layout, start + 4 * i, None, instruction_asm(start + 4 * i, False)) for i in range(length - 1)]
+                lines.append(format_row(layout, start + 4 * (length - 1), target, instruction_asm(start + 4 * (length - 1), True)))
+                rows.append("\n".join(lines) + "\n")
+            block_rows[(block, successor)] = (length, rows)
+        return block_rows[(block, successor)]
+
+    for layout in layouts:
+        os.makedirs(f"{path}/{layout}", exist_ok=True)
+    per_file = -(-instructions // files)
+    written = 0
+    block = 0
+    for file_idx in range(files):
+        trace_files = []
+        for layout in layouts:
+            filename, header, *_ = TRACE_LAYOUTS[layout]
+            trace_files.append(open(f"{path}/{layout}/{filename.format(file_idx)}", 'w'))
+            trace_files[-1].write(header + "\n")
+        file_written = 0
+        while file_written < per_file and written < instructions:
+            successor = rng.randrange(len(program)) if rng.random() < taken else (block + 1) % len(program)
+            length, rows = rows_of(block, successor)
+            for trace_file, row in zip(trace_files, rows):
+                trace_file.write(row)
+            file_written += length
+            written += length
+            block = successor
+        for trace_file in trace_files:
+            trace_file.close()
+    return written
+
+def peak_rss():
+    """ Peak resident set size of this process and its (finished) worker processes in MiB """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+def run_pipeline(path, pipeline, export_path, backend="python", jobs=1):
+    """ Extracts the basic blocks and their assembly from generated traces like extract_basic_blocks.py does and times each
+        stage. Returns the stage times in seconds, the number of rows and basic blocks. """
+    count_layout, asm_layout = PIPELINES[pipeline]
+    _, _, delimiter, pc_idx, br_target_idx = TRACE_LAYOUTS[count_layout]
+    _, _, asm_delimiter, asm_pc_idx, asm_idx = TRACE_LAYOUTS[asm_layout]
+    if asm_layout == "ti":
+        asm_idx = TI_ASM_IDX
+    count_path = f"{path}/{count_layout}"
+    asm_path = f"{path}/{asm_layout}"
+    times = {}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        files = find_trace_files(count_path, lambda f: "_trace_" in f)
+        file_transitions = count_file_transitions(files, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=backend, jobs=jobs)
+        times["counting"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        basic_blocks = basic_blocks_from_transitions(link_trace_transitions(file_transitions))
+        times["discovery"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        asm_index = build_asm_index(asm_path, lambda f: "_trace_" in f, pc_idx=asm_pc_idx, asm_idx=asm_idx, delimiter=asm_delimiter)
+        addresses = sorted(basic_blocks)
+        executed_pcs = sorted(asm_index)
+        # blocks that were never entered (e.g. unexecuted code after a branch) have no assembly in the traces
+        assembly = {bb_start: extract_asm_from_index(bb_start, bb_next, asm_index, executed_pcs) for bb_start, bb_next in zip(addresses, addresses[1:]) if basic_blocks[bb_start]}
+        times["asm"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        export_basic_blocks(f"{export_path}/basic_blocks.csv", basic_blocks)
+        export_basic_blocks_db(f"{export_path}/basic_blocks.bbdb", basic_blocks)
+        for bb_start, lines in assembly.items():
+            with open(f"{export_path}/{hex(bb_start)}.txt", 'w') as asm_file:
+                asm_file.write("\n".join(lines))
+        times["export"] = time.perf_counter() - start
+
+    return times, sum(transitions for partial, _ in file_transitions for transitions in partial.values()), len(basic_blocks)
+
+def benchmark_pipeline(path, pipeline, repeat=1, backend="python", jobs=1):
+    """ Runs a pipeline repeat times and keeps the fastest time of each stage. Meant to run in a fresh worker process, so
+        that the peak RSS only covers this pipeline. """
+    best = {}
+    for _ in range(repeat):
+        export_path = tempfile.mkdtemp(prefix="export_", dir=path)
+        try:
+            times, rows, blocks = run_pipeline(path, pipeline, export_path, backend=backend, jobs=jobs)
+        finally:
+            shutil.rmtree(export_path)
+        for stage, seconds in times.items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+    return {"pipeline": pipeline, "rows": rows, "blocks": blocks, "times": best, "peak_rss_mib": peak_rss()}
+
+def directory_size(path):
+    return sum(os.path.getsize(f"{path}/{filename}") for filename in os.listdir(path))
+
+def print_results(results):
+    print(f"{'pipeline':<10}{'stage':<12}{'seconds':>10}{'rows/s':>14}")
+    print("-" * 46)
+    for result in results:
+        for stage in STAGES:
+            seconds = result["times"][stage]
+            rate = f"{result['rows'] / seconds:>14.0f}" if seconds > 0 else f"{'-':>14}"
+            print(f"{result['pipeline']:<10}{stage:<12}{seconds:>10.3f}{rate}")
+        total = sum(result["times"].values())
+        print(f"{result['pipeline']:<10}{'total':<12}{total:>10.3f}{result['rows'] / total:>14.0f}")
+        print(f"-> {result['rows']} rows ({result['trace_mib']:.1f} MiB), {result['blocks']} basic blocks, peak RSS {result['peak_rss_mib']:.1f} MiB")
+        print("-" * 46)
+
+def main():
+
+    def positive_integer(num):
+        """" Enforces that an argument is a positive integer """
+        num = int(float(num))
+        if num <= 0:
+            raise argparse.ArgumentTypeError(f"expected positive integer!")
+        return num
+
+    def fraction_type(num):
+        """" Enforces that an argument is a number in (0, 1] """
+        num = float(num)
+        if not 0 < num <= 1:
+            raise argparse.ArgumentTypeError(f"expected number in (0, 1]!")
+        return num
+
+    argParser = argparse.ArgumentParser(description="Benchmarks extract_basic_blocks.py on synthetic traces, no simulator required.")
+    argParser.add_argument("-p", "--pipelines", nargs="+", choices=PIPELINES.keys(), default=list(PIPELINES.keys()), help="Trace layouts to benchmark: 'ti' (instruction traces) or 'tp' (performance traces with assembly traces).")
+    argParser.add_argument("-n", "--instructions", type=positive_integer, default=1000000, help="Number of instructions (rows) per trace (default: %(default)s).")
+    argParser.add_argument("--blocks", type=positive_integer, default=1000, help="Number of basic blocks of the synthetic program (default: %(default)s).")
+    argParser.add_argument("--branch-density", type=fraction_type, default=0.15, help="Average fraction of branch instructions (default: %(default)s).")
+    argParser.add_argument("--files", type=positive_integer, default=4, help="Number of files each trace is split into (default: %(default)s).")
+    argParser.add_argument("--seed", type=int, default=0, help="Seed of the trace generator (default: %(default)s).")
+    argParser.add_argument("-r", "--repeat", type=positive_integer, default=3, help="Number of runs per pipeline, the fastest time of each stage is reported (default: %(default)s).")
+    argParser.add_argument("-b", "--backend", choices=["python", "numpy"], default="python", help="Backend used to count the transitions.")
+    argParser.add_argument("-j", "--jobs", type=positive_integer, default=1, help="Number of trace files that are parsed in parallel.")
+    argParser.add_argument("-d", "--directory", default=None, help="Directory the traces are generated in, they are kept (default: temporary directory).")
+    argParser.add_argument("-o", "--output", default=None, help="Path of a json file the results are written to.")
+    args = argParser.parse_args()
+
+    path = args.directory or tempfile.mkdtemp(prefix="bb_benchmark_")
+    try:
+        layouts = sorted({layout for pipeline in args.pipelines for layout in PIPELINES[pipeline]})
+        program = generate_program(args.blocks, args.branch_density, seed=args.seed)
+        print(f"Generating {args.instructions} instructions of {args.blocks} basic blocks in '{path}' ({', '.join(layouts)})...")
+        generate_traces(path, layouts, program, args.instructions, files=args.files, seed=args.seed)
+
+        results = []
+        for pipeline in args.pipelines:
+            print(f"Benchmarking '{pipeline}'...")
+            # a fresh process per pipeline, so peak RSS of one pipeline does not include the others
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(benchmark_pipeline, path, pipeline, repeat=args.repeat, backend=args.backend, jobs=args.jobs).result()
+            result["trace_mib"] = sum(directory_size(f"{path}/{layout}") for layout in set(PIPELINES[pipeline])) / (1 << 20)
+            results.append(result)
+    finally:
+        if args.directory is None:
+            shutil.rmtree(path)
+
+    print_results(results)
+    if args.output is not None:
+        config = {key: value for key, value in vars(args).items() if key not in ("directory", "output")}
+        with open(args.output, 'w') as out_file:
+            json.dump({"config": config, "results": results}, out_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+
+# Binary trace format, its record layout is derived from the traceValues of a monitor description:
+#   header:  magic, version, header size, record size, number of fields, sampling period and window (both 0 if every
+#            instruction is traced), followed by one field description (type, width, name length, name) per traceValue in
+#            the order of the description
+#   records: presence mask (bit i is set if traceValue i was written for the instruction, 1 to 8 bytes depending on
+#            the number of traceValues), followed by the fields as
+#            fixed-width little-endian values. Strings are interned and stored as index into the string table, unless
+#            they are marked with "intern": false, which stores them NUL padded to their size.
+#   trailer: string table (number of strings, then length and utf-8 bytes of each string) and its offset. The trailer
+#            is written when the trace file is closed, traces of an interrupted simulation end after the last record.
+TRACE_MAGIC = b'PSWTRACE'
+BINARY_TRACE_SUFFIX = ".bin"
+TRACE_VERSION = 2
+# version 1 traces have no sampling and are still read
+TRACE_HEADERS = {1: struct.Struct('<8sIIII'), 2: struct.Struct('<8sIIIIII')}
+TRACE_HEADER = TRACE_HEADERS[TRACE_VERSION]
+TRACE_PREAMBLE = struct.Struct('<8sI')
+TRACE_FIELD = struct.Struct('<BHH')
+MAX_TRACE_VALUES = 64
+STRING_TABLE_MAGIC = b'PSWSTRT\0'
+STRING_TABLE_TRAILER = struct.Struct('<8sQ')
+
+FIELD_UINT = 0
+FIELD_STRING = 1
+FIELD_STRING_ID = 2
+UINT_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+def trace_layout(description):
+    """ Derives the record layout [(name, type, width)] of a monitor description from its traceValues. Values are as wide
+        as the registers of the core unless they specify a width (in bytes) themselves. Strings (e.g. the assembly, which
+        repeats for every execution of an instruction) are interned unless they set "intern": false. """
+    trace = description["trace"]
+    xlen = 8 if re.match(r'RV64', trace.get("core", ""), re.IGNORECASE) else 4
+    if len(trace["traceValues"]) > MAX_TRACE_VALUES:
+        raise ValueError(f"Binary traces support at most {MAX_TRACE_VALUES} trace values!")
+    layout = []
+    for value in trace["traceValues"]:
+        if value.get("type") == "string":
+            if value.get("intern", True):
+                layout.append((value["name"], FIELD_STRING_ID, 4))
+            else:
+                layout.append((value["name"], FIELD_STRING, int(value["size"])))
+        else:
+            width = int(value.get("width", xlen))
+            if width not in UINT_FORMATS:
+                raise ValueError(f"Unsupported width {width} of trace value '{value['name']}'!")
+            layout.append((value["name"], FIELD_UINT, width))
+    return layout
+
+def mask_width(layout):
+    """ Size of the presence mask in bytes, the smallest unsigned integer with a bit per trace value """
+    return min(width for width in UINT_FORMATS if width * 8 >= len(layout))
+
+def record_size(layout):
+    return mask_width(layout) + sum(width for _, _, width in layout)
+
+def trace_header(layout, sampling=None):
+    """ Self-describing header of a binary trace with the given layout and sampling (period, window) """
+    fields = b''.join(TRACE_FIELD.pack(kind, width, len(name.encode())) + name.encode() for name, kind, width in layout)
+    period, window = sampling or (0, 0)
+    return TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_HEADER.size + len(fields), record_size(layout), len(layout), period, window) + fields
+
+def header_sampling(data):
+    """ Returns (period, window) of a binary trace from the start of its header, or None if it traces every instruction """
+    magic, version = TRACE_PREAMBLE.unpack_from(data)
+    if magic != TRACE_MAGIC or version not in TRACE_HEADERS:
+        raise ValueError(f"No binary trace of version {TRACE_VERSION}!")
+    _, _, _, _, _, *sampling = TRACE_HEADERS[version].unpack_from(data)
+    return tuple(sampling) if sampling and sampling[0] else None
+
+def record_format(layout, names=None):
+    """ struct format of a record, fields that are not in names are skipped as padding """
+    fmt = '<' + UINT_FORMATS[mask_width(layout)]
+    for name, kind, width in layout:
+        if names is not None and name not in names:
+            fmt += f'{width}x'
+        elif kind == FIELD_STRING:
+            fmt += f'{width}s'
+        else:
+            fmt += UINT_FORMATS[width]
+    return fmt
+
+class BinaryTraceWriter:
+    """ Writes a binary trace, e.g. to convert existing text traces """
+
+    def __init__(self, path, layout, sampling=None):
+        self.layout = layout
+        self.record = struct.Struct(record_format(layout))
+        self.strings = {}
+        self.file = open(path, 'wb')
+        self.file.write(trace_header(layout, sampling))
+
+    def write(self, values):
+        """ Writes one record, values maps trace value names to ints or strings, missing values are left unset """
+        mask = 0
+        fields = []
+        for idx, (name, kind, width) in enumerate(self.layout):
+            value = values.get(name)
+            if value is not None:
+                mask |= 1 << idx
+            if kind == FIELD_STRING:
+                fields.append((value or '').encode()[:width])
+            elif kind == FIELD_STRING_ID:
+                fields.append(0 if value is None else self.strings.setdefault(value, len(self.strings)))
+            else:
+                fields.append(value or 0)
+        self.file.write(self.record.pack(mask, *fields))
+
+    def close(self):
+        offset = self.file.tell()
+        self.file.write(struct.pack('<I', len(self.strings)))
+        for string in self.strings:
+            data = string.encode()
+            self.file.write(struct.pack('<H', len(data)) + data)
+        self.file.write(STRING_TABLE_TRAILER.pack(STRING_TABLE_MAGIC, offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def is_binary_trace(filename):
+    with open(filename, 'rb') as trace_file:
+        return trace_file.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+class BinaryTrace:
+    """ Memory-mapped binary trace. records is a zero-copy view of all complete records. The content of a trace can also
+        be passed as data, e.g. after decompressing it. """
+
+    def __init__(self, filename, data=None):
+        if data is not None:
+            self.mmap = data
+        else:
+            with open(filename, 'rb') as trace_file:
+                size = os.fstat(trace_file.fileno()).st_size
+                self.mmap = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if len(self.mmap) < TRACE_HEADERS[1].size:
+            raise ValueError(f"'{filename}' is no binary trace!")
+        magic, version = TRACE_PREAMBLE.unpack_from(self.mmap)
+        if magic != TRACE_MAGIC or version not in TRACE_HEADERS:
+            raise ValueError(f"'{filename}' is no binary trace of version {TRACE_VERSION}!")
+        _, _, header_size, self.record_size, nfields, *sampling = TRACE_HEADERS[version].unpack_from(self.mmap)
+        self.sampling = tuple(sampling) if sampling and sampling[0] else None
+
+        self.layout = []
+        offset = TRACE_HEADERS[version].size
+        for _ in range(nfields):
+            kind, width, name_length = TRACE_FIELD.unpack_from(self.mmap, offset)
+            offset += TRACE_FIELD.size
+            self.layout.append((bytes(self.mmap[offset:offset + name_length]).decode(), kind, width))
+            offset += name_length
+
+        end = len(self.mmap)
+        self.strings = None
+        if end - header_size >= STRING_TABLE_TRAILER.size:
+            magic, table_offset = STRING_TABLE_TRAILER.unpack_from(self.mmap, end - STRING_TABLE_TRAILER.size)
+            if magic == STRING_TABLE_MAGIC and header_size <= table_offset <= end - STRING_TABLE_TRAILER.size:
+                self.strings = self.read_strings(table_offset)
+                end = table_offset
+        self.count = (end - header_size) // self.record_size
+        self.records = memoryview(self.mmap)[header_size:header_size + self.count * self.record_size]
+
+    def read_strings(self, offset):
+        [count] = struct.unpack_from('<I', self.mmap, offset)
+        offset += 4
+        strings = []
+        for _ in range(count):
+            [length] = struct.unpack_from('<H', self.mmap, offset)
+            strings.append(bytes(self.mmap[offset + 2:offset + 2 + length]).decode())
+            offset += 2 + length
+        return strings
+
+    def field_index(self, name):
+        return [field[0] for field in self.layout].index(name)
+
+    def iter_fields(self, *indices):
+        """ Yields (presence mask, *fields) for every record, only the fields at the given indices are unpacked """
+        names = {self.layout[idx][0] for idx in indices}
+        return struct.Struct(record_format(self.layout, names)).iter_unpack(self.records)
+
+    def string(self, idx, value):
+        """ Decodes the value of a string field """
+        if self.layout[idx][1] == FIELD_STRING_ID:
+            if self.strings is None:
+                raise ValueError("Binary trace has no string table, it was not closed properly!")
+            return self.strings[value]
+        return value.rstrip(b'\0').decode()
+
+    def close(self):
+        self.records.release()
+        if isinstance(self.mmap, mmap.mmap):
+            self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def trace_sampling(description):
+    """ Returns (period, window) of a monitor description with "sampling": {"period": N, "window": W}, or None. Sampled
+        traces only contain the first window instructions of every period instructions, counted across all chunks of a
+        trace. """
+    sampling = description["trace"].get("sampling")
+    if sampling is None:
+        return None
+    period, window = int(sampling["period"]), int(sampling.get("window", 1))
+    if window < 1 or period < window:
+        raise ValueError(f"Invalid sampling of {window} every {period} instructions!")
+    return (period, window)
+
+def trace_file_order(filename):
+    """ Sort key that orders trace chunks by their number, e.g. '_trace_2' before '_trace_10' """
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', filename)]
+
+def convert_text_trace(filename, out_filename, layout, delimiter, sampling=None, row=0):
+    """ Converts a text trace (hex fields joined by delimiter, one header line) into a binary trace. If sampling is given,
+        only the sampled instructions are kept and recorded in the header. row is the number of instructions in the
+        preceding chunks of the trace, so that the sampling continues across chunks. Returns the row after this chunk. """
+    with open(filename, 'r') as text_file, BinaryTraceWriter(out_filename, layout, sampling) as writer:
+        text_file.readline() # skip header
+        for line in text_file:
+            if not line.strip():
+                continue
+            row += 1
+            if sampling is not None and (row - 1) % sampling[0] >= sampling[1]:
+                continue
+            fields = line.rstrip('\n').split(delimiter)
+            values = {}
+            for (name, kind, _), field in zip(layout, fields):
+                field = field.strip()
+                if not field or field.startswith('-'):
+                    continue
+                values[name] = field if kind != FIELD_UINT else int(field, 16)
+            writer.write(values)
+    return row
+
+def main():
+
+    def exisiting_file_type(path):
+        """" Enforces that an argument is a path to a valid file """
+        if os.path.exists(path) and os.path.isfile(path):
+            return path
+        raise argparse.ArgumentTypeError(f"'{path}' is not a valid file!")
+
+    def text_trace_type(path):
+        """" Enforces that an argument is a text trace of a monitor description (.txt) """
+        if not path.endswith(".txt"):
+            raise argparse.ArgumentTypeError(f"'{path}' is no text trace of a monitor description (.txt)!")
+        return exisiting_file_type(path)
+
+    argParser = argparse.ArgumentParser(description="Converts text traces into the binary trace format of a monitor description.")
+    argParser.add_argument("description", type=exisiting_file_type, help="Monitor description (.json) the traces were generated with.")
+    argParser.add_argument("traces", nargs="*", type=text_trace_type, help="Text traces to convert, '.txt' is replaced by '.bin'. The chunks of a trace directory are sampled in the order of their number.")
+    argParser.add_argument("--header", action="store_true", help="If this flag is set, the record layout of the description is printed.")
+    argParser.add_argument("--remove", action="store_true", help="If this flag is set, the text traces are removed after their conversion, so that only the (sampled) binary traces are kept.")
+    args = argParser.parse_args()
+
+    with open(args.description, 'r') as description_file:
+        description = json.load(description_file)
+    layout = trace_layout(description)
+    sampling = trace_sampling(description)
+    if args.header:
+        kinds = {FIELD_UINT: "uint", FIELD_STRING: "string", FIELD_STRING_ID: "string id"}
+        for name, kind, width in layout:
+            print(f"{name:<16} {kinds[kind]:<10} {width} bytes")
+        print(f"-> {record_size(layout)} bytes per record")
+        if sampling is not None:
+            print(f"-> window of {sampling[1]} every {sampling[0]} instructions")
+
+    # the sampling of a trace continues across its chunks, i.e. the rows are counted per trace directory
+    rows = {}
+    for filename in sorted(args.traces, key=lambda f: (os.path.dirname(os.path.abspath(f)), trace_file_order(os.path.basename(f)))):
+        trace_dir = os.path.dirname(os.path.abspath(filename))
+        out_filename = re.sub(r'\.txt$', '', filename) + BINARY_TRACE_SUFFIX
+        rows[trace_dir] = convert_text_trace(filename, out_filename, layout, description["trace"].get("separator", ","), sampling=sampling, row=rows.get(trace_dir, 0))
+        print(f"- {filename} -> {out_filename} ({os.path.getsize(out_filename)} of {os.path.getsize(filename)} bytes)")
+        if args.remove:
+            os.remove(filename)
+
+if __name__ == "__main__":
+    main()
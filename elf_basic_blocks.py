@@ -0,0 +1,229 @@
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import struct
+
+# Static basic block map of a RISC-V ELF binary. The executable sections are decoded linearly (16-bit compressed and
+# 32-bit instructions), every control flow instruction ends a basic block and its direct target as well as its successor
+# start a new one. Function symbols start a basic block as well, as they are the targets of indirect calls.
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+EM_RISCV = 243
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+SHF_EXECINSTR = 0x4
+STT_NOTYPE = 0
+STT_FUNC = 2
+BLOCK_MAP_VERSION = 1 # must be increased whenever the block maps of unchanged binaries change
+
+# RV32I/RV64I opcodes that end a basic block
+OPCODE_BRANCH = 0x63
+OPCODE_JALR = 0x67
+OPCODE_JAL = 0x6f
+OPCODE_SYSTEM = 0x73
+SYSTEM_BLOCK_ENDS = (0x000, 0x001, 0x002, 0x102, 0x302) # ecall, ebreak, uret, sret, mret (wfi does not end a block)
+
+def sign_extend(value, bits):
+    return value - (1 << bits) if value & (1 << (bits - 1)) else value
+
+def instruction_length(halfword):
+    """ Length of the instruction starting with the given 16-bit parcel, only 16 and 32-bit instructions are used by RV32/64 GC """
+    return 4 if halfword & 0x3 == 0x3 else 2
+
+def decode_control_flow(insn, length, pc, xlen):
+    """ Checks if an instruction ends a basic block. Returns (ends block, direct target or None). """
+    if length == 4:
+        opcode = insn & 0x7f
+        if opcode == OPCODE_BRANCH:
+            imm = ((insn >> 31) & 0x1) << 12 | ((insn >> 7) & 0x1) << 11 | ((insn >> 25) & 0x3f) << 5 | ((insn >> 8) & 0xf) << 1
+            return True, pc + sign_extend(imm, 13)
+        if opcode == OPCODE_JAL:
+            imm = ((insn >> 31) & 0x1) << 20 | ((insn >> 12) & 0xff) << 12 | ((insn >> 20) & 0x1) << 11 | ((insn >> 21) & 0x3ff) << 1
+            return True, pc + sign_extend(imm, 21)
+        if opcode == OPCODE_JALR:
+            return True, None
+        if opcode == OPCODE_SYSTEM and insn & 0xfffff == OPCODE_SYSTEM and insn >> 20 in SYSTEM_BLOCK_ENDS:
+            return True, None
+        return False, None
+
+    quadrant = insn & 0x3
+    funct3 = (insn >> 13) & 0x7
+    if quadrant == 1 and (funct3 == 5 or (funct3 == 1 and xlen == 32)):
+        # c.j, c.jal (RV32 only, c.addiw on RV64)
+        imm = ((insn >> 12) & 0x1) << 11 | ((insn >> 11) & 0x1) << 4 | ((insn >> 9) & 0x3) << 8 | ((insn >> 8) & 0x1) << 10 \
+            | ((insn >> 7) & 0x1) << 6 | ((insn >> 6) & 0x1) << 7 | ((insn >> 3) & 0x7) << 1 | ((insn >> 2) & 0x1) << 5
+        return True, pc + sign_extend(imm, 12)
+    if quadrant == 1 and funct3 in (6, 7):
+        # c.beqz, c.bnez
+        imm = ((insn >> 12) & 0x1) << 8 | ((insn >> 10) & 0x3) << 3 | ((insn >> 5) & 0x3) << 6 | ((insn >> 3) & 0x3) << 1 \
+            | ((insn >> 2) & 0x1) << 5
+        return True, pc + sign_extend(imm, 9)
+    if quadrant == 2 and funct3 == 4 and (insn >> 2) & 0x1f == 0:
+        # c.jr, c.jalr (rs1 != 0) and c.ebreak (rs1 == 0, bit 12 set), c.mv/c.add have rs2 != 0
+        rs1 = (insn >> 7) & 0x1f
+        if rs1 != 0 or (insn >> 12) & 0x1:
+            return True, None
+    return False, None
+
+def read_elf(filename):
+    """ Reads the executable sections [(address, data)], the function symbols {address: name}, all code symbols (functions
+        and labels of assembly code) and the register width of a RISC-V ELF binary """
+    with open(filename, 'rb') as elf_file:
+        elf = elf_file.read()
+    if elf[:4] != ELF_MAGIC:
+        raise ValueError(f"'{filename}' is no ELF binary!")
+    if elf[4] == ELFCLASS32:
+        xlen, header, section = 32, struct.Struct('<16xHHIIIIIHHHHHH'), struct.Struct('<IIIIIIIIII')
+        symbol = struct.Struct('<IIIBBH')
+    elif elf[4] == ELFCLASS64:
+        xlen, header, section = 64, struct.Struct('<16xHHIQQQIHHHHHH'), struct.Struct('<IIQQQQIIQQ')
+        symbol = struct.Struct('<IBBHQQ')
+    else:
+        raise ValueError(f"'{filename}' has an unknown ELF class!")
+    if elf[5] != 1:
+        raise ValueError(f"'{filename}' is no little-endian ELF binary!")
+    _, machine, _, _, _, shoff, _, _, _, _, shentsize, shnum, _ = header.unpack_from(elf)
+    if machine != EM_RISCV:
+        raise ValueError(f"'{filename}' is no RISC-V binary!")
+
+    # (name, type, flags, address, offset, size, link, info, alignment, entry size)
+    sections = [section.unpack_from(elf, shoff + idx * shentsize) for idx in range(shnum)]
+    code = [(addr, elf[offset:offset + size]) for _, kind, flags, addr, offset, size, *_ in sections
+            if flags & SHF_EXECINSTR and kind != SHT_NOBITS and size > 0]
+
+    functions = {}
+    labels = {}
+    for _, kind, _, _, offset, size, link, _, _, entsize in sections:
+        if kind != SHT_SYMTAB:
+            continue
+        strtab_offset = sections[link][4]
+        for sym_offset in range(offset, offset + size, entsize):
+            if xlen == 32:
+                name, value, _, info, _, shndx = symbol.unpack_from(elf, sym_offset)
+            else:
+                name, info, _, shndx, value, _ = symbol.unpack_from(elf, sym_offset)
+            if info & 0xf not in (STT_FUNC, STT_NOTYPE) or not 0 < shndx < len(sections) or not sections[shndx][2] & SHF_EXECINSTR:
+                continue
+            end = elf.index(b'\0', strtab_offset + name)
+            name = elf[strtab_offset + name:end].decode(errors='replace')
+            if info & 0xf == STT_FUNC:
+                functions.setdefault(value, name)
+            elif name and not name.startswith(('$', '.L')): # skip mapping symbols and local labels of the compiler
+                labels.setdefault(value, name)
+    return code, functions, {**labels, **functions}, xlen
+
+def build_block_map(filename):
+    """ Decodes the executable sections of a binary into basic blocks. Returns the sorted instruction addresses, the sorted
+        block leaders and the function symbols. """
+    code, functions, symbols, xlen = read_elf(filename)
+    addresses = []
+    leaders = set()
+    for section_start, data in code:
+        leaders.add(section_start)
+        offset = 0
+        while offset + 2 <= len(data):
+            [halfword] = struct.unpack_from('<H', data, offset)
+            if halfword == 0:
+                # the all-zero parcel is an illegal instruction, used as padding between functions
+                offset += 2
+                continue
+            length = instruction_length(halfword)
+            if offset + length > len(data):
+                break
+            insn = halfword if length == 2 else struct.unpack_from('<I', data, offset)[0]
+            pc = section_start + offset
+            addresses.append(pc)
+            ends_block, target = decode_control_flow(insn, length, pc, xlen)
+            if ends_block:
+                leaders.add(pc + length)
+                if target is not None:
+                    leaders.add(target)
+            offset += length
+    addresses.sort()
+    leaders.update(functions)
+    # leaders that are no instruction (e.g. targets outside of the binary or the end of a section) are dropped
+    instructions = set(addresses)
+    leaders = sorted(leader for leader in leaders if leader in instructions)
+    return {"version": BLOCK_MAP_VERSION, "xlen": xlen, "addresses": addresses, "leaders": leaders,
+            "symbols": {str(address): name for address, name in sorted(symbols.items())}}
+
+class BlockMap:
+    """ Static basic blocks of a binary. Blocks end before the next leader or at the end of a section, so their end is
+        exact even for compressed instructions and the last block of the program. """
+
+    def __init__(self, data):
+        self.addresses = data["addresses"]
+        self.leaders = data["leaders"]
+        self.symbol_starts = sorted(int(address) for address in data["symbols"])
+        self.symbol_names = [data["symbols"][str(address)] for address in self.symbol_starts]
+
+    def block_instructions(self, start, next_leader=None):
+        """ Addresses of the instructions of the block starting at start, up to the next leader or a gap in the code """
+        idx = bisect.bisect_left(self.addresses, start)
+        if next_leader is None:
+            leader_idx = bisect.bisect_right(self.leaders, start)
+            next_leader = self.leaders[leader_idx] if leader_idx < len(self.leaders) else None
+        instructions = []
+        while idx < len(self.addresses) and (next_leader is None or self.addresses[idx] < next_leader):
+            if instructions and self.addresses[idx] > instructions[-1] + 4:
+                break # end of section
+            instructions.append(self.addresses[idx])
+            idx += 1
+        return instructions
+
+    def instructions_between(self, start, end):
+        """ Addresses of the instructions from start to end (inclusive) """
+        return self.addresses[bisect.bisect_left(self.addresses, start):bisect.bisect_right(self.addresses, end)]
+
+    def count_instructions(self, start, end):
+        return bisect.bisect_right(self.addresses, end) - bisect.bisect_left(self.addresses, start)
+
+    def symbol(self, address):
+        """ Name of the symbol preceding address with the offset to the symbol, e.g. 'main+0x1c' """
+        idx = bisect.bisect_right(self.symbol_starts, address) - 1
+        if idx < 0:
+            return ""
+        offset = address - self.symbol_starts[idx]
+        return self.symbol_names[idx] + (f"+{offset:#x}" if offset else "")
+
+    def __contains__(self, address):
+        idx = bisect.bisect_left(self.addresses, address)
+        return idx < len(self.addresses) and self.addresses[idx] == address
+
+def export_block_map(path, data):
+    with open(path, 'w') as out_file:
+        json.dump(data, out_file)
+
+def read_block_map(filepath):
+    """ Reads an exported block map, returns None if it was built by another version """
+    with open(filepath, 'r') as in_file:
+        data = json.load(in_file)
+    return BlockMap(data) if data.get("version") == BLOCK_MAP_VERSION else None
+
+def elf_fingerprint(filename):
+    with open(filename, 'rb') as elf_file:
+        return hashlib.sha256(elf_file.read() + f"block map {BLOCK_MAP_VERSION}".encode()).hexdigest()
+
+def main():
+
+    def exisiting_file_type(path):
+        """" Enforces that an argument is a path to a valid file """
+        if os.path.exists(path) and os.path.isfile(path):
+            return path
+        raise argparse.ArgumentTypeError(f"'{path}' is not a valid file!")
+
+    argParser = argparse.ArgumentParser(description="Prints the static basic blocks of a RISC-V ELF binary.")
+    argParser.add_argument("binary", type=exisiting_file_type, help="RISC-V ELF binary.")
+    args = argParser.parse_args()
+
+    block_map = BlockMap(build_block_map(args.binary))
+    for start in block_map.leaders:
+        instructions = block_map.block_instructions(start)
+        print(f"address 0x{start:08x} - 0x{instructions[-1]:08x} | instructions {len(instructions):<4} | {block_map.symbol(start)}")
+    print(f"-> {len(block_map.leaders)} basic blocks, {len(block_map.addresses)} instructions")
+
+if __name__ == "__main__":
+    main()
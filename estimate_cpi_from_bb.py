@@ -0,0 +1,426 @@
+import argparse
+import ast
+import concurrent.futures
+import csv
+import hashlib
+import json
+import os
+import re
+import runpy
+import subprocess
+import sys
+import time
+import traceback
+
+from extract_basic_blocks import extract_basic_blocks_csv, extract_basic_blocks_db, parse_asm
+from extract_cpi_from_study import parse_study_log
+from run_report import RUN_REPORT_DIR, RunReport, atomic_write
+
+WORKSPACE = os.path.dirname(os.path.abspath(__file__))
+M2ISAR_PERF = os.environ.get("PSW_M2ISAR_PERF", f"{WORKSPACE}/code_gen/generators/M2-ISA-R-Perf")
+DEFAULT_PERF_MODEL = f"{WORKSPACE}/code_gen/descriptions/core_perf_dsl/SimpleRISCV.corePerfDsl"
+CPI_PATTERN = re.compile(r'CPI\D*?(\d+(?:\.\d+)?(?:e[+-]?\d+)?)')
+COLUMNS = ["core", "benchmark", "model", "block", "cpi", "cached", "error"]
+PROGRAM_COLUMNS = ["core", "benchmark", "model", "instructions", "coverage", "cpi", "cpi_min", "cpi_max", "reference_cpi", "error", "relative_error"]
+CPI_CACHE_VERSION = 1 # must be increased whenever the estimates of unchanged blocks and models change
+CPI_CACHE_ENTRIES = 1 << 16 # default number of block estimates kept in the cache
+DEFAULT_CPI_CACHE = f"{WORKSPACE}/cache/block_cpi_cache.json"
+MODEL_IMPORT_PATTERN = re.compile(r'^\s*import\s+"([^"]+)"', re.MULTILINE)
+
+def find_block_files(path):
+    """ Lists (core, benchmark, block file) for an export directory of extract_basic_blocks.py or for all export
+        directories of a traces tree (<traces>/<core>/<benchmark>/export) """
+    if not os.path.isdir(path):
+        raise ValueError(f"'{path}' is not a valid directory!")
+
+    export_dirs = []
+    if any(f.endswith(".txt") for f in os.listdir(path)):
+        export_dirs.append(path)
+    else:
+        for root, dirs, _ in os.walk(path):
+            if os.path.basename(root) == "export":
+                export_dirs.append(root)
+            dirs.sort()
+
+    blocks = []
+    for export_dir in sorted(export_dirs):
+        benchmark_dir = os.path.dirname(os.path.abspath(export_dir))
+        benchmark = os.path.basename(benchmark_dir)
+        core = os.path.basename(os.path.dirname(benchmark_dir))
+        for filename in sorted(os.listdir(export_dir), key=block_address):
+            if filename.endswith(".txt"):
+                blocks.append((core, benchmark, f"{export_dir}/{filename}"))
+    return blocks
+
+def block_address(filename):
+    """ Start address of an exported basic block, e.g. '0x1a4.txt' """
+    try:
+        return int(os.path.splitext(os.path.basename(filename))[0], 16)
+    except ValueError:
+        return -1
+
+def normalize_block(lines):
+    """ Canonical form of an exported basic block: one 'name op, op, ...' line per instruction, independent of
+        whitespace and of the address the block was found at """
+    instructions = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            name, operands = parse_asm(line)
+            instructions.append(f"{name} {', '.join(operands)}".lower())
+        except ValueError:
+            instructions.append(" ".join(line.split()).lower())
+    return "\n".join(instructions)
+
+def model_identity(perf_model, run_script):
+    """ Hashes a performance model, the files it imports and the sources of M2-ISA-R-Perf, so that cached estimates
+        are invalidated whenever the model or the estimator changes """
+    identity = hashlib.sha256(f"version:{CPI_CACHE_VERSION}\n".encode())
+    pending = [os.path.abspath(perf_model)]
+    seen = set()
+    while pending:
+        model_file = pending.pop()
+        if model_file in seen or not os.path.isfile(model_file):
+            continue
+        seen.add(model_file)
+        with open(model_file, 'rb') as f:
+            content = f.read()
+        identity.update(hashlib.sha256(content).digest())
+        imports = MODEL_IMPORT_PATTERN.findall(content.decode(errors='replace'))
+        pending.extend(os.path.join(os.path.dirname(model_file), i) for i in reversed(imports))
+
+    run_dir = os.path.dirname(os.path.abspath(run_script))
+    for root, dirs, files in os.walk(run_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(".py"):
+                with open(f"{root}/{filename}", 'rb') as f:
+                    identity.update(f"{os.path.relpath(f'{root}/{filename}', run_dir)}\n".encode())
+                    identity.update(hashlib.sha256(f.read()).digest())
+    return identity.hexdigest()
+
+def block_key(block_file, model_id):
+    """ Cache key of a block: hash of its normalized instruction sequence and the model identity """
+    with open(block_file, 'r', errors='replace') as f:
+        block = normalize_block(f)
+    return hashlib.sha256(f"{model_id}\n{block}".encode()).hexdigest()
+
+class CpiCache:
+    """ Persistent cache of block estimates, the least recently used entries are evicted once it exceeds max_entries """
+
+    def __init__(self, path, max_entries=CPI_CACHE_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as cache_file:
+                    cache = json.load(cache_file)
+                if cache.get("version") == CPI_CACHE_VERSION:
+                    self.entries = cache["entries"]
+            except (ValueError, KeyError):
+                print(f"- ignoring corrupt cpi cache '{path}'")
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        entry["used"] = time.time()
+        return entry["cpi"]
+
+    def put(self, key, cpi):
+        self.entries[key] = {"cpi": cpi, "used": time.time()}
+
+    def save(self):
+        if len(self.entries) > self.max_entries:
+            keep = sorted(self.entries.items(), key=lambda entry: entry[1]["used"])[-self.max_entries:]
+            self.entries = dict(keep)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with atomic_write(self.path) as temp_path, open(temp_path, 'w') as cache_file:
+            json.dump({"version": CPI_CACHE_VERSION, "entries": self.entries}, cache_file)
+
+# M2-ISA-R-Perf has no library API to load a model once and estimate many blocks with it, so run.py parses the model for
+# every block. Workers import the modules of run.py once and run every block in a forked child of themselves, so that
+# only the model parsing is paid per block and no state of one block leaks into the next. Without fork, every block is
+# estimated in a new interpreter.
+def init_estimator(run_script):
+    """ Prepares a worker process: run.py finds its package modules and its top-level imports are loaded once """
+    run_dir = os.path.dirname(os.path.abspath(run_script))
+    for import_path in (run_dir, os.path.dirname(run_dir)):
+        if import_path not in sys.path:
+            sys.path.insert(0, import_path)
+    if not hasattr(os, "fork"):
+        return
+    with open(run_script, 'r') as script_file:
+        tree = ast.parse(script_file.read(), filename=run_script)
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                exec(compile(ast.Module(body=[node], type_ignores=[]), run_script, "exec"), {"__name__": "__psw_preload__"})
+            except Exception:
+                pass # e.g. relative imports, run.py reports them itself
+
+def run_forked(run_script, argv):
+    """ Runs a script as __main__ in a forked child of this process, returns (exit code, stdout) """
+    read_fd, write_fd = os.pipe()
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.close(read_fd)
+            os.dup2(write_fd, 1)
+            sys.stdout = open(1, 'w', closefd=False)
+            sys.argv = argv
+            runpy.run_path(run_script, run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'r') as output_file:
+        output = output_file.read()
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status), output
+
+def estimate_block(run_script, perf_model, block_file):
+    """ Executes 'run.py <perf model> -b <block>' and returns the reported CPI """
+    argv = [run_script, perf_model, "-b", block_file]
+    if hasattr(os, "fork"):
+        returncode, output = run_forked(run_script, argv)
+    else:
+        process = subprocess.run([sys.executable, *argv], stdout=subprocess.PIPE, text=True)
+        returncode, output = process.returncode, process.stdout
+    if returncode != 0:
+        raise RuntimeError(f"run.py exited with code {returncode}")
+    matches = CPI_PATTERN.findall(output)
+    if not matches:
+        raise RuntimeError("run.py did not report a CPI")
+    return float(matches[-1])
+
+def estimate_block_result(run_script, perf_model, block_file):
+    """ Returns (cpi, None) or (None, error) """
+    try:
+        return estimate_block(run_script, perf_model, block_file), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+def model_labels(perf_models):
+    """ Labels of the performance models in the model column (and grouping key) of the estimates: the file name, or the
+        resolved path if several models share it. Returns a dict of resolved path -> label, models passed twice are
+        estimated once. """
+    paths = list(dict.fromkeys(os.path.abspath(perf_model) for perf_model in perf_models))
+    names = [os.path.basename(path) for path in paths]
+    return {path: name if names.count(name) == 1 else path for path, name in zip(paths, names)}
+
+def estimate_blocks(blocks, perf_model, run_script=None, jobs=1, cache=None, label=None):
+    """ Estimates the CPI of all blocks with a pool of worker processes and returns one row (see COLUMNS) per block,
+        labeled with the file name of the model unless a label is given (see model_labels). Blocks with the same
+        instruction sequence are only estimated once, blocks found in the cache not at all. """
+    run_script = run_script or f"{M2ISAR_PERF}/m2isar_perf/run.py"
+    model_id = model_identity(perf_model, run_script)
+    keys = [block_key(block_file, model_id) for _, _, block_file in blocks]
+
+    results = {}
+    pending = {}
+    for key, (_, _, block_file) in zip(keys, blocks):
+        cpi = cache.get(key) if cache is not None else None
+        if cpi is not None:
+            results[key] = (cpi, None)
+        elif key not in pending:
+            pending[key] = block_file
+
+    if jobs > 1 and len(pending) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_estimator, initargs=(run_script,)) as executor:
+            estimates = executor.map(estimate_block_result, [run_script] * len(pending), [perf_model] * len(pending), pending.values(), chunksize=8)
+            estimates = list(estimates)
+    else:
+        init_estimator(run_script)
+        estimates = [estimate_block_result(run_script, perf_model, block_file) for block_file in pending.values()]
+    for key, (cpi, error) in zip(pending, estimates):
+        results[key] = (cpi, error)
+        if cache is not None and error is None:
+            cache.put(key, cpi)
+
+    rows = []
+    for key, (core, benchmark, block_file) in zip(keys, blocks):
+        cpi, error = results[key]
+        block = os.path.splitext(os.path.basename(block_file))[0]
+        rows.append({"core": core, "benchmark": benchmark, "model": label or os.path.basename(perf_model), "block": block, "cpi": cpi, "cached": key not in pending, "error": error})
+    return rows
+
+def load_block_profile(benchmark_path):
+    """ Reads the basic blocks (start address -> count) extracted for a benchmark, prefers the binary database. Returns
+        (basic_blocks, block_info), block_info holds the exact block sizes of an extraction with the binary or is None. """
+    if os.path.isfile(f"{benchmark_path}/basic_blocks.bbdb"):
+        return extract_basic_blocks_db(f"{benchmark_path}/basic_blocks.bbdb", with_block_info=True)
+    if os.path.isfile(f"{benchmark_path}/basic_blocks.csv"):
+        return extract_basic_blocks_csv(f"{benchmark_path}/basic_blocks.csv", with_block_info=True)
+    return None
+
+def block_sizes(basic_blocks, block_info=None):
+    """ Yields (start, instructions) of every basic block whose size is known: exact with block_info, otherwise derived
+        from the next leader (4 bytes per instruction, the last block is skipped) """
+    if block_info is not None:
+        for bb_start in basic_blocks:
+            yield bb_start, block_info[bb_start][1]
+        return
+    basic_block_addresses = sorted(basic_blocks)
+    for bb_start, bb_next in zip(basic_block_addresses, basic_block_addresses[1:]): # skip last entry
+        yield bb_start, (bb_next - 4 - bb_start) // 4 + 1
+
+def estimate_program_cpi(basic_blocks, block_cpi, block_info=None):
+    """ Estimates the CPI of a whole program as the instruction weighted mean of the block estimates.
+        Instructions of blocks without an estimate (below the cut-off of the export or failed) are assumed to run at the
+        mean CPI, cpi_min and cpi_max bound them by the fastest and the slowest estimated block instead. """
+    total_instructions = 0
+    covered_instructions = 0
+    covered_cycles = 0
+    for bb_start, ninstructions in block_sizes(basic_blocks, block_info):
+        instructions = ninstructions * basic_blocks[bb_start]
+        total_instructions += instructions
+        cpi = block_cpi.get(bb_start)
+        if cpi is not None:
+            covered_instructions += instructions
+            covered_cycles += instructions * cpi
+
+    estimate = {"instructions": total_instructions, "coverage": None, "cpi": None, "cpi_min": None, "cpi_max": None}
+    if covered_instructions == 0:
+        return estimate
+    uncovered_instructions = total_instructions - covered_instructions
+    estimate["coverage"] = covered_instructions / total_instructions
+    estimate["cpi"] = covered_cycles / covered_instructions
+    estimate["cpi_min"] = (covered_cycles + uncovered_instructions * min(block_cpi.values())) / total_instructions
+    estimate["cpi_max"] = (covered_cycles + uncovered_instructions * max(block_cpi.values())) / total_instructions
+    return estimate
+
+def estimate_programs(blocks, rows):
+    """ Combines the block estimates of every (core, benchmark, model) with the block profile of the benchmark and
+        compares the result to the CPI reported by the full simulation, if its log is available """
+    benchmark_paths = {}
+    for core, benchmark, block_file in blocks:
+        benchmark_paths[(core, benchmark)] = os.path.dirname(os.path.dirname(os.path.abspath(block_file)))
+    block_cpi = {}
+    for row in rows:
+        estimates = block_cpi.setdefault((row["core"], row["benchmark"], row["model"]), {})
+        if row["cpi"] is not None:
+            estimates[int(row["block"], 16)] = row["cpi"]
+
+    programs = []
+    profiles = {}
+    for (core, benchmark, model), estimates in block_cpi.items():
+        benchmark_path = benchmark_paths[(core, benchmark)]
+        if (core, benchmark) not in profiles:
+            profiles[(core, benchmark)] = load_block_profile(benchmark_path)
+        if profiles[(core, benchmark)] is None:
+            print(f"- skipping {core}/{benchmark}: no basic blocks found in '{benchmark_path}'")
+            continue
+        basic_blocks, block_info = profiles[(core, benchmark)]
+        program = {"core": core, "benchmark": benchmark, "model": model, **estimate_program_cpi(basic_blocks, estimates, block_info)}
+        program["reference_cpi"] = program["error"] = program["relative_error"] = None
+        log_path = f"{benchmark_path}/{benchmark}_log.txt"
+        if os.path.isfile(log_path):
+            program["reference_cpi"] = parse_study_log(log_path)["cpi"]
+        if program["cpi"] is not None and program["reference_cpi"]:
+            program["error"] = program["cpi"] - program["reference_cpi"]
+            program["relative_error"] = program["error"] / program["reference_cpi"]
+        programs.append(program)
+    return programs
+
+def export_block_cpi(path, rows, columns=COLUMNS):
+    with open(path, 'w', newline='') as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def main():
+
+    def exisiting_dir_type(path):
+        """" Enforces that an argument is a path to a valid location """
+        if os.path.exists(path) and os.path.isdir(path):
+            return path
+        raise argparse.ArgumentTypeError(f"'{path}' is not a valid directory!")
+
+    def exisiting_path_type(path):
+        """" Enforces that an argument is a path to a valid location """
+        if os.path.exists(path):
+            return path
+        raise argparse.ArgumentTypeError(f"'{path}' does not exist!")
+
+    def positive_integer(num):
+        """" Enforces that an argument is a positive integer """
+        num = int(num)
+        if num <= 0:
+            raise argparse.ArgumentTypeError(f"expected positive integer greater than 0!")
+        return num
+
+    argParser = argparse.ArgumentParser(description="Estimates the CPI of exported basic blocks with M2-ISA-R-Perf in a single batch.")
+    argParser.add_argument("path", type=exisiting_dir_type, help="Export directory of extract_basic_blocks.py or a traces tree containing <core>/<benchmark>/export directories.")
+    argParser.add_argument("-m", "--model", nargs="+", type=exisiting_path_type, default=[DEFAULT_PERF_MODEL], help="Performance models (.corePerfDsl) used for the estimation, each block is estimated with every model (default: %(default)s).")
+    argParser.add_argument("-j", "--jobs", type=positive_integer, default=os.cpu_count(), help="Number of worker processes (default: number of cores).")
+    argParser.add_argument("-o", "--output", help="Csv file the estimates are written to (default: <path>/block_cpi.csv).")
+    argParser.add_argument("-p", "--program", action="store_true", help="If this flag is set, the block estimates are weighted with the basic block profile of each benchmark to estimate its CPI without a full simulation (written to <path>/program_cpi.csv).")
+    argParser.add_argument("--cache", default=DEFAULT_CPI_CACHE, help="Persistent cache of block estimates, shared by all studies (default: %(default)s).")
+    argParser.add_argument("--cache-entries", type=positive_integer, default=CPI_CACHE_ENTRIES, help="Maximum number of cached block estimates, the least recently used are evicted (default: %(default)s).")
+    argParser.add_argument("--no-cache", action="store_true", help="If this flag is set, every block is estimated again and no results are cached.")
+    argParser.add_argument("--report", help=f"Json file the run report (wall and CPU time, I/O volume and peak RSS of every stage) is written to. Defaults to a new file in ${RUN_REPORT_DIR} if set.")
+    args = argParser.parse_args()
+
+    run_script = f"{M2ISAR_PERF}/m2isar_perf/run.py"
+    if not os.path.isfile(run_script):
+        argParser.error(f"M2-ISA-R-Perf not found at '{M2ISAR_PERF}'!")
+
+    report = RunReport("estimate_cpi_from_bb", path=args.report)
+    blocks = find_block_files(args.path)
+    cache = None if args.no_cache else CpiCache(args.cache, max_entries=args.cache_entries)
+    models = model_labels(args.model)
+    rows = []
+    for model, label in models.items():
+        print(f"Estimating {len(blocks)} basic blocks with '{model}'...")
+        with report.stage("estimate", model=model, rows=len(blocks)) as stage:
+            model_rows = estimate_blocks(blocks, model, run_script=run_script, jobs=args.jobs, cache=cache, label=label)
+            stage["cached"] = sum(1 for row in model_rows if row["cached"])
+        rows += model_rows
+    if cache is not None:
+        cache.save()
+
+    if not args.program:
+        for row in rows:
+            cpi = "-" if row["cpi"] is None else f"{row['cpi']:.5}"
+            model = f" [{row['model']}]" if len(models) > 1 else ""
+            print(f"{row['core']}/{row['benchmark']}{model}: {row['block']:<12} CPI {cpi}" + (f" ({row['error']})" if row["error"] else ""))
+
+    output = args.output or f"{args.path}/block_cpi.csv"
+    export_block_cpi(output, rows)
+    failed = sum(1 for row in rows if row["error"])
+    cached = sum(1 for row in rows if row["cached"])
+    print(f"-> Estimated {len(rows) - failed} of {len(rows)} basic blocks ({cached} from cache), results written to '{output}'")
+
+    if args.program:
+        with report.stage("programs"):
+            programs = estimate_programs(blocks, rows)
+
+        def cell(value, spec="<10.5"):
+            return f"{'-':<10}" if value is None else f"{value:{spec}}"
+
+        print(f"{'program':>32}\t{'cpi':<10}\t{'bounds':<23}\t{'coverage':<10}\t{'full run':<10}\t{'error':<10}")
+        print("-" * 110)
+        for program in programs:
+            model = f" [{program['model']}]" if len(models) > 1 else ""
+            name = f"{program['core'].split('_H_')[-1]}/{program['benchmark']}{model}"
+            bounds = f"{cell(program['cpi_min'])} - {cell(program['cpi_max'])}"
+            coverage = None if program["coverage"] is None else program["coverage"] * 100
+            relative_error = None if program["relative_error"] is None else program["relative_error"] * 100
+            print(f"{name:>32}\t{cell(program['cpi'])}\t{bounds}\t{cell(coverage, '<9.4')}%\t{cell(program['reference_cpi'])}\t{cell(relative_error, '<+9.3')}%")
+        program_output = os.path.join(os.path.dirname(os.path.abspath(output)), "program_cpi.csv")
+        export_block_cpi(program_output, programs, columns=PROGRAM_COLUMNS)
+        print(f"-> Program estimates written to '{program_output}'")
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,975 @@
+import array
+import bisect
 import csv
 import sys
+import collections
+import concurrent.futures
+import functools
+import gzip
+import hashlib
+import importlib.util
+import io
+import itertools
+import json
+import math
+import mmap
+import re
+import stat
+import struct
 import os
 import argparse
 from pathlib import Path
 
-def extract_basic_blocks_from_traces(path, check_filename, pc_idx, br_target_idx, delimiter=','):
+from binary_trace import BINARY_TRACE_SUFFIX, FIELD_STRING, TRACE_HEADER, TRACE_MAGIC, BinaryTrace, header_sampling, mask_width, trace_file_order
+from elf_basic_blocks import BlockMap, build_block_map, elf_fingerprint, export_block_map, read_block_map
+from run_report import RUN_REPORT_DIR, RunReport, atomic_write
+
+TRACE_CHUNK_SIZE = 1 << 23 # number of bytes read from a trace file at once
+
+# compressed trace chunks are detected by their magic number and decompressed while they are read
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+
+def strip_compression_suffix(filename):
+    """ File name of a trace chunk without '.gz' or '.zst', so that file name checks work for compressed chunks """
+    for suffix in COMPRESSED_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+def trace_compression(magic):
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+def is_compressed_trace(filename):
+    with open(filename, 'rb') as trace_file:
+        return trace_compression(trace_file.read(len(ZSTD_MAGIC))) is not None
+
+def open_zstd(file):
+    """ Opens a zstd compressed file (name or binary stream), uses compression.zstd (Python 3.14+) or zstandard """
+    try:
+        from compression import zstd
+        return zstd.ZstdFile(file)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd compressed traces require Python 3.14 or the zstandard package!")
+    # the buffered reader adds readline and read1
+    if isinstance(file, str):
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(file, 'rb'), read_across_frames=True, closefd=True))
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True, closefd=False))
+
+def open_trace_file(filename):
+    """ Opens a trace file for binary reading, gzip and zstd compressed files are decompressed on the fly """
+    with open(filename, 'rb') as trace_file:
+        compression = trace_compression(trace_file.read(len(ZSTD_MAGIC)))
+    if compression == "gzip":
+        return gzip.open(filename, 'rb')
+    if compression == "zstd":
+        return open_zstd(filename)
+    return open(filename, 'rb')
+
+def open_trace_stream(stream):
+    """ Wraps a binary stream (stdin or a named pipe), so that compressed streams are decompressed on the fly """
+    compression = trace_compression(stream.peek(len(ZSTD_MAGIC))) if hasattr(stream, 'peek') else None
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == "zstd":
+        return open_zstd(stream)
+    return stream
+
+def is_binary_trace(filename):
+    """ Checks if a (compressed) trace file starts with the header of a binary trace (see binary_trace.py) """
+    with open_trace_file(filename) as trace_file:
+        return trace_file.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+def open_binary_trace(filename):
+    """ Memory-maps a binary trace, compressed binary traces are decompressed into memory instead """
+    if is_compressed_trace(filename):
+        with open_trace_file(filename) as trace_file:
+            return BinaryTrace(filename, data=trace_file.read())
+    return BinaryTrace(filename)
+
+def read_trace_chunks(filename, chunk_size=TRACE_CHUNK_SIZE):
+    """ Reads a trace file in large byte chunks that always end on a complete line (skips the header) """
+    with open_trace_file(filename) as trace_file:
+        trace_file.readline() # skip header
+        yield from read_stream_chunks(trace_file, chunk_size)
+
+def read_stream_chunks(stream, chunk_size=TRACE_CHUNK_SIZE):
+    """ Reads a binary stream in chunks of at most chunk_size bytes that always end on a complete line """
+    # read1 returns whatever a pipe has available instead of waiting until chunk_size bytes arrived
+    read = getattr(stream, 'read1', stream.read)
+    remainder = b''
+    while data := read(chunk_size):
+        data = remainder + data
+        end = data.rfind(b'\n') + 1
+        remainder = data[end:]
+        if end:
+            yield data[:end]
+    if remainder:
+        yield remainder
+
+def is_trace_stream(path):
+    """ Checks if a trace path refers to stdin ('-') or a named pipe instead of a directory of trace files """
+    return path == '-' or (os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode))
+
+def split_trace_lines(chunk):
+    """ Splits a chunk of a trace file into its non-empty lines """
+    lines = chunk.split(b'\n')
+    if not all(lines):
+        lines = [line for line in lines if line]
+    return lines
+
+def trace_record_pattern(pc_idx, br_target_idx, delimiter):
+    """ Builds a regex that extracts (pc, branch target) from every line of a trace chunk """
+    field = b'[^' + re.escape(delimiter) + b'\n]*'
+    columns = [(b'(' + field + b')') if idx in (pc_idx, br_target_idx) else field for idx in range(max(pc_idx, br_target_idx) + 1)]
+    return re.compile(b'^' + re.escape(delimiter).join(columns), re.MULTILINE)
+
+def parse_trace_record(record, pc_idx, br_target_idx, delimiter):
+    """ Converts a trace record into (pc, branch target), the branch target is None if the instruction is no branch """
+    if isinstance(record, bytes):
+        record = record.split(delimiter)
+        record = (record[pc_idx], record[br_target_idx])
+    pc, br_target = record
+    if br_target.strip().startswith(b'-'):
+        return (int(pc, 16), None)
+    return (int(pc, 16), int(br_target, 16))
+
+def count_trace_transitions(filename, pc_idx, br_target_idx, delimiter=','):
+    """ Counts how often each (previous pc, pc, branch target) transition occurs in a trace file using a single pass.
+        The previous pc of the first instruction is None, as it is the last pc of the preceding trace file. Returns the
+        transitions and the last pc of the file. """
+    if is_binary_trace(filename):
+        return count_binary_transitions(filename, pc_idx=pc_idx, br_target_idx=br_target_idx)
+    with open_trace_file(filename) as trace_file:
+        return count_stream_transitions(trace_file, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter)
+
+def count_stream_transitions(stream, pc_idx, br_target_idx, delimiter=','):
+    """ Same as count_trace_transitions, but for a binary stream that starts with the header line. Memory usage only
+        depends on the number of distinct transitions, not on the length of the stream. """
+    byte_delimiter = delimiter.encode()
+    # rows of compact traces only hold the pc and the branch target, so whole lines can be counted without splitting them
+    compact = len(stream.readline().split(byte_delimiter)) <= max(pc_idx, br_target_idx) + 1
+    pattern = trace_record_pattern(pc_idx, br_target_idx, byte_delimiter)
+
+    # count raw records first, each distinct record is only parsed once afterwards
+    raw_transitions = collections.Counter()
+    prev_record = None
+    for chunk in read_stream_chunks(stream):
+        if compact:
+            records = split_trace_lines(chunk)
+        else:
+            records = pattern.findall(chunk)
+            if pc_idx > br_target_idx:
+                records = [(pc, br_target) for br_target, pc in records]
+        if not records:
+            continue
+        raw_transitions.update(zip(itertools.chain((prev_record,), records), records))
+        prev_record = records[-1]
+
+    records = {None: (None, None)}
+    transitions = collections.Counter()
+    for (prev, curr), count in raw_transitions.items():
+        for r in (prev, curr):
+            if r not in records:
+                records[r] = parse_trace_record(r, pc_idx, br_target_idx, byte_delimiter)
+        transitions[(records[prev][0], *records[curr])] += count
+    return transitions, records[prev_record][0]
+
+NUMPY_WINDOW_SIZE = 1 << 24 # number of bytes of a memory-mapped trace that are processed at once
+NUMPY_NONE = (1 << 64) - 1 # marks missing branch targets and previous pcs in the columnar backend
+
+def numpy_trace_fields(np, window, line_starts, line_ends, delimiters, idx):
+    """ Returns start and end offsets of column idx for every line of a trace window """
+    first = np.searchsorted(delimiters, line_starts)
+    # the end of the line acts as an additional delimiter
+    delimiters = np.append(delimiters, window.size)
+    if idx == 0:
+        starts = line_starts.copy()
+    else:
+        starts = delimiters[np.minimum(first + idx - 1, delimiters.size - 1)] + 1
+        if np.any(starts > line_ends):
+            raise ValueError(f"Trace line has less than {idx + 1} columns!")
+    ends = np.minimum(delimiters[np.minimum(first + idx, delimiters.size - 1)], line_ends)
+    # strip whitespace like str.strip() does
+    for bounds, offset, step in ((starts, 0, 1), (ends, -1, -1)):
+        while True:
+            space = (starts < ends) & (window[np.minimum(bounds + offset, window.size - 1)] <= 0x20)
+            if not space.any():
+                break
+            bounds += step * space
+    return starts, ends
+
+def numpy_parse_hex(np, window, starts, ends):
+    """ Converts hex fields given by start and end offsets into an uint64 array """
+    # skip optional '0x' prefix
+    prefixed = (ends - starts >= 2) & (window[starts] == ord('0')) & ((window[np.minimum(starts + 1, window.size - 1)] | 0x20) == ord('x'))
+    starts = starts + 2 * prefixed
+    widths = ends - starts
+    if widths.size == 0:
+        return np.zeros(0, dtype=np.uint64)
+    if widths.min() <= 0 or widths.max() > 16:
+        raise ValueError("Trace contains an invalid hex value!")
+    lut = np.full(256, 0xff, dtype=np.uint8)
+    for digit in b'0123456789':
+        lut[digit] = digit - ord('0')
+    for digit in b'abcdef':
+        lut[digit] = lut[digit - 0x20] = digit - ord('a') + 10
+    # accumulate one digit column at a time (right-aligned), so memory stays linear in the number of fields
+    values = np.zeros(widths.size, dtype=np.uint64)
+    for digit in range(int(widths.max()), 0, -1):
+        present = widths >= digit
+        nibbles = lut[window[np.where(present, ends - digit, 0)]]
+        nibbles[~present] = 0
+        if np.any(nibbles == 0xff):
+            raise ValueError("Trace contains an invalid hex value!")
+        values <<= np.uint64(4)
+        values |= nibbles
+    return values
+
+def count_trace_transitions_numpy(filename, pc_idx, br_target_idx, delimiter=','):
+    """ Columnar variant of count_trace_transitions, parses pc and branch target columns of a memory-mapped trace into arrays """
+    import numpy as np
+
+    if is_binary_trace(filename):
+        return count_binary_transitions_numpy(filename, pc_idx=pc_idx, br_target_idx=br_target_idx)
+    window_transitions = []
+    prev_pc = np.full(1, NUMPY_NONE, dtype=np.uint64)
+    for window, newlines in numpy_trace_windows(np, filename):
+        line_starts = np.concatenate(([0], newlines[:-1] + 1))
+        line_ends = newlines
+        non_empty = line_ends > line_starts
+        line_starts, line_ends = line_starts[non_empty], line_ends[non_empty]
+        if line_starts.size == 0:
+            continue
+        delimiters = np.flatnonzero(window == ord(delimiter))
+
+        pc_starts, pc_ends = numpy_trace_fields(np, window, line_starts, line_ends, delimiters, pc_idx)
+        br_starts, br_ends = numpy_trace_fields(np, window, line_starts, line_ends, delimiters, br_target_idx)
+        pcs = numpy_parse_hex(np, window, pc_starts, pc_ends)
+        is_branch = (br_starts >= br_ends) | (window[np.minimum(br_starts, window.size - 1)] != ord('-'))
+        br_targets = np.full(pcs.size, NUMPY_NONE, dtype=np.uint64)
+        br_targets[is_branch] = numpy_parse_hex(np, window, br_starts[is_branch], br_ends[is_branch])
+
+        prev_pc = numpy_count_transitions(np, window_transitions, prev_pc, pcs, br_targets)
+    last_pc = None if prev_pc[0] == NUMPY_NONE else int(prev_pc[0])
+    return numpy_merge_transitions(np, window_transitions), last_pc
+
+def numpy_trace_windows(np, filename):
+    """ Yields windows of complete lines of a trace (without its header) and the offsets of their line ends. Uncompressed
+        traces are memory-mapped, compressed traces are decompressed window by window. """
+    if is_compressed_trace(filename):
+        for chunk in read_trace_chunks(filename, NUMPY_WINDOW_SIZE):
+            window = np.frombuffer(chunk, dtype=np.uint8)
+            newlines = np.flatnonzero(window == ord('\n'))
+            if window[-1] != ord('\n'):
+                newlines = np.append(newlines, window.size)
+            yield window, newlines
+        return
+
+    with open(filename, 'rb') as trace_file:
+        header_size = len(trace_file.readline())
+    if os.path.getsize(filename) <= header_size:
+        return
+    trace = np.memmap(filename, dtype=np.uint8, mode='r')
+    start = header_size
+    while start < trace.size:
+        end = min(start + NUMPY_WINDOW_SIZE, trace.size)
+        window = trace[start:end]
+        newlines = np.flatnonzero(window == ord('\n'))
+        if end < trace.size:
+            if newlines.size == 0:
+                raise ValueError(f"Trace line in '{filename}' exceeds {NUMPY_WINDOW_SIZE} bytes!")
+            window = window[:newlines[-1] + 1]
+        elif window[-1] != ord('\n'):
+            newlines = np.append(newlines, window.size)
+        start += window.size
+        yield window, newlines
+
+def numpy_unique_rows(np, rows, counts=None):
+    """ Unique (previous pc, pc, branch target) rows of a (n x 3) uint64 array and how often each occurs (summing counts) """
+    keys, inverse = np.unique(np.ascontiguousarray(rows).view(np.dtype((np.void, rows.itemsize * 3))).ravel(), return_inverse=True)
+    return keys.view(np.uint64).reshape(-1, 3), np.bincount(inverse.ravel(), weights=counts, minlength=keys.size).astype(np.int64)
+
+def numpy_count_transitions(np, window_transitions, prev_pc, pcs, br_targets):
+    """ Appends the unique transitions of a window of pcs and branch targets (NUMPY_NONE for no branch) with their counts
+        to window_transitions. prev_pc is the last pc of the preceding window, the last pc of this window is returned. """
+    prev_pcs = np.concatenate((prev_pc, pcs[:-1]))
+
+    # sequential rows are fully described by their pc, so only the remaining rows need the full (previous pc, pc, branch target) key
+    sequential = (br_targets == NUMPY_NONE) & (prev_pcs != NUMPY_NONE) & (prev_pcs + 4 == pcs)
+    seq_pcs, counts = np.unique(pcs[sequential], return_counts=True)
+    window_transitions.append((np.stack((seq_pcs - 4, seq_pcs, np.full(seq_pcs.size, NUMPY_NONE, dtype=np.uint64)), axis=1), counts))
+    window_transitions.append(numpy_unique_rows(np, np.stack((prev_pcs, pcs, br_targets), axis=1)[~sequential]))
+    return pcs[-1:]
+
+def numpy_merge_transitions(np, window_transitions):
+    """ Merges the unique transitions of all windows of a trace into a Counter of (previous pc, pc, branch target). The keys
+        are only converted to python objects once per unique transition. """
+    if not window_transitions:
+        return collections.Counter()
+    rows, counts = numpy_unique_rows(np, np.concatenate([rows for rows, _ in window_transitions]), np.concatenate([counts for _, counts in window_transitions]))
+    columns = []
+    for column in rows.T:
+        values = column.astype(object)
+        values[column == NUMPY_NONE] = None
+        columns.append(values)
+    return collections.Counter(dict(zip(zip(*columns), counts.tolist())))
+
+BINARY_WINDOW_RECORDS = 1 << 20 # number of records of a binary trace that are processed at once
+
+def count_binary_transitions(filename, pc_idx, br_target_idx):
+    """ Variant of count_trace_transitions for binary traces (see binary_trace.py). Only the pc and branch target fields
+        are unpacked straight from the memory-mapped records. """
+    with open_binary_trace(filename) as trace:
+        records = trace.iter_fields(pc_idx, br_target_idx)
+        raw_transitions = collections.Counter()
+        prev_record = None
+        while window := list(itertools.islice(records, BINARY_WINDOW_RECORDS)):
+            raw_transitions.update(zip(itertools.chain((prev_record,), window), window))
+            prev_record = window[-1]
+        del records # releases the memory-mapped records
+
+    branch_bit = 1 << br_target_idx
+    def parse_binary_record(record):
+        mask, first, second = record
+        pc, br_target = (first, second) if pc_idx < br_target_idx else (second, first)
+        return (pc, br_target if mask & branch_bit else None)
+
+    records = {None: (None, None)}
+    transitions = collections.Counter()
+    for (prev, curr), count in raw_transitions.items():
+        for r in (prev, curr):
+            if r not in records:
+                records[r] = parse_binary_record(r)
+        transitions[(records[prev][0], *records[curr])] += count
+    return transitions, records[prev_record][0]
+
+def count_binary_transitions_numpy(filename, pc_idx, br_target_idx):
+    """ Columnar variant of count_binary_transitions, the records are viewed as a structured array without copying them """
+    import numpy as np
+
+    window_transitions = []
+    prev_pc = np.full(1, NUMPY_NONE, dtype=np.uint64)
+    with open_binary_trace(filename) as trace:
+        dtype = np.dtype([("mask", f'<u{mask_width(trace.layout)}')] + [(name, f'S{width}' if kind == FIELD_STRING else f'<u{width}') for name, kind, width in trace.layout])
+        records = np.frombuffer(trace.records, dtype=dtype)
+        pc_name, br_target_name = trace.layout[pc_idx][0], trace.layout[br_target_idx][0]
+        window_size = max(1, NUMPY_WINDOW_SIZE // trace.record_size)
+        for start in range(0, records.size, window_size):
+            window = records[start:start + window_size]
+            pcs = window[pc_name].astype(np.uint64)
+            is_branch = (window["mask"].astype(np.uint64) >> np.uint64(br_target_idx)) & np.uint64(1) == 1
+            br_targets = np.where(is_branch, window[br_target_name].astype(np.uint64), np.uint64(NUMPY_NONE))
+            prev_pc = numpy_count_transitions(np, window_transitions, prev_pc, pcs, br_targets)
+        del records, window
+    last_pc = None if prev_pc[0] == NUMPY_NONE else int(prev_pc[0])
+    return numpy_merge_transitions(np, window_transitions), last_pc
+
+def link_trace_transitions(file_transitions):
+    """ Merges the transitions of consecutive trace files, the first instruction of a file follows the last pc of the preceding one """
+    transitions = collections.Counter()
+    last_pc = 0
+    for partial_transitions, partial_last_pc in file_transitions:
+        for (prev_pc, pc, br_target), count in partial_transitions.items():
+            if prev_pc is None:
+                prev_pc = last_pc
+            transitions[(prev_pc, pc, br_target)] += count
+        if partial_last_pc is not None:
+            last_pc = partial_last_pc
+    return transitions
+
+TRACE_BACKENDS = {
+    "python": count_trace_transitions,
+    "numpy": count_trace_transitions_numpy,
+}
+
+def add_transition_leaders(transitions, leaders, pc_counts, last_pc=0):
+    """ Adds the leaders and pc counts of counted trace transitions to the given set and Counter. Transitions without
+        previous pc (the first instruction of a trace file) follow last_pc. """
+    for (prev_pc, pc, br_target), count in transitions.items():
+        pc_counts[pc] += count
+        if br_target is None:
+            if (last_pc if prev_pc is None else prev_pc) + 4 != pc:
+                leaders.add(pc)
+            continue
+        leaders.add(pc + 4)
+        leaders.add(br_target)
+
+def basic_blocks_from_transitions(transitions):
+    """ Derives the basic block leaders and how often each basic block was entered from counted trace transitions """
+    leaders = set()
+    pc_counts = collections.Counter()
+    add_transition_leaders(transitions, leaders, pc_counts)
+    return {leader: pc_counts[leader] for leader in leaders}
+
+def block_edges_from_transitions(transitions, basic_blocks):
+    """ Counts how often control passes from one basic block to another (including fall-through), using the transitions
+        the basic blocks were derived from. Blocks are referred to by their index in the sorted leaders, so the edges are
+        a Counter of (source index, target index). Returns the sorted leaders and the edges. """
+    leaders = sorted(basic_blocks)
+    index = {leader: idx for idx, leader in enumerate(leaders)}
+    edges = collections.Counter()
+    for (prev_pc, pc, _), count in transitions.items():
+        target = index.get(pc)
+        if target is None or prev_pc is None:
+            continue # not the entry of a basic block
+        source = bisect.bisect_right(leaders, prev_pc) - 1
+        if source >= 0:
+            edges[(source, target)] += count
+    return leaders, edges
+
+SUPERBLOCK_MIN_PROBABILITY = 0.5 # a superblock only continues along edges that are taken at least this often
+
+def form_superblocks(basic_blocks, block_edges, min_probability=SUPERBLOCK_MIN_PROBABILITY):
+    """ Grows superblocks (single-entry paths of basic blocks) from an edge profile. Starting from the hottest block that
+        is not part of a superblock yet, a path follows the most frequent successor edge as long as it is taken with at
+        least min_probability, it is the most frequent predecessor edge of the successor and the successor is still free.
+        Returns the paths as lists of block indices into the sorted leaders. """
+    leaders, edges = block_edges
+    best_successor = {}
+    best_predecessor = {}
+    for (source, target), count in edges.items():
+        if count > best_successor.get(source, (None, 0))[1]:
+            best_successor[source] = (target, count)
+        if count > best_predecessor.get(target, (None, 0))[1]:
+            best_predecessor[target] = (source, count)
+
+    counts = [basic_blocks[leader] for leader in leaders]
+    visited = set()
+    superblocks = []
+    for seed in sorted(range(len(leaders)), key=lambda idx: -counts[idx]):
+        if seed in visited or counts[seed] == 0:
+            continue
+        path = [seed]
+        visited.add(seed)
+        while path[-1] in best_successor:
+            target, count = best_successor[path[-1]]
+            if target in visited or count < min_probability * counts[path[-1]] or best_predecessor[target][0] != path[-1]:
+                break
+            path.append(target)
+            visited.add(target)
+        superblocks.append(path)
+    return superblocks
+
+def rank_superblocks(basic_blocks, block_edges, superblocks, block_instructions):
+    """ Ranks superblocks by the number of instructions executed in their blocks, given the instructions of each block
+        (see block_instruction_counts). Returns rows of (blocks, instructions, entries, completions, dynamic instructions),
+        completions is an upper bound of how often the whole path was taken. """
+    leaders, edges = block_edges
+    # blocks of unknown size (the last one without the binary) do not count
+    sizes = [block_instructions.get(leader, 0) for leader in leaders]
+    rows = []
+    for path in superblocks:
+        blocks = [leaders[idx] for idx in path]
+        completions = min([edges[edge] for edge in zip(path, path[1:])], default=basic_blocks[blocks[0]])
+        dynamic_instructions = sum(sizes[idx] * basic_blocks[leaders[idx]] for idx in path)
+        rows.append((blocks, sum(sizes[idx] for idx in path), basic_blocks[blocks[0]], completions, dynamic_instructions))
+    rows.sort(key=lambda row: -row[4])
+    return rows
+
+def export_block_edges(path, block_edges):
+    leaders, edges = block_edges
+    lines = ["source, target, count\n"]
+    for (source, target), count in sorted(edges.items(), key=lambda edge: (-edge[1], edge[0])):
+        lines.append(f'0x{leaders[source]:08x}, 0x{leaders[target]:08x}, {count}\n')
+    with open(path, 'w') as out_file:
+        out_file.write("".join(lines))
+
+def export_superblocks(path, ranked_superblocks, total_instructions):
+    lines = ["rank, blocks, instructions, entries, completions, dynamic_instructions, coverage\n"]
+    for rank, (blocks, instructions, entries, completions, dynamic_instructions) in enumerate(ranked_superblocks, 1):
+        coverage = dynamic_instructions / total_instructions if total_instructions else 0
+        lines.append(f'{rank}, {" ".join(f"0x{bb_start:08x}" for bb_start in blocks)}, {instructions}, {entries}, {completions}, {dynamic_instructions}, {coverage:.6f}\n')
+    with open(path, 'w') as out_file:
+        out_file.write("".join(lines))
+
+HOT_PATH_PRINTED_BLOCKS = 8
+
+def print_hot_paths(hot_paths, total_instructions, cut_off):
+    """ Prints the hot paths that match the cut-off, which applies to their entries or their coverage like for basic blocks """
+    print("Hot paths:")
+    for rank, (blocks, instructions, entries, completions, dynamic_instructions) in enumerate(hot_paths, 1):
+        coverage = dynamic_instructions / total_instructions
+        if (cut_off < 1 and coverage < cut_off) or (cut_off >= 1 and entries < cut_off):
+            continue
+        print(f'#{rank:<3} blocks {len(blocks):<3} | instructions {instructions:<4} | entries {entries:<6} | completions {completions:<6} ({coverage * 100:.4}%)')
+        path = ' -> '.join(hex(bb_start) for bb_start in blocks[:HOT_PATH_PRINTED_BLOCKS])
+        if len(blocks) > HOT_PATH_PRINTED_BLOCKS:
+            path += f" -> ... ({len(blocks) - HOT_PATH_PRINTED_BLOCKS} more, see hot_paths.csv)"
+        print(f"     {path}")
+
+TRACE_CACHE_VERSION = 1 # must be increased whenever the cached results of unchanged traces change
+TRACE_CACHE_SIZE = 1 << 30 # default size limit of a trace cache directory in bytes
+TRACE_FINGERPRINT_SAMPLE = 1 << 20 # number of bytes hashed at the start and the end of each trace file
+
+def trace_fingerprint(files, **config):
+    """ Fingerprints trace files by name, size, modification time and a hash of their first and last MiB, together with
+        the configuration used to parse them """
+    fingerprint = hashlib.sha256(json.dumps({"version": TRACE_CACHE_VERSION, **config}, sort_keys=True).encode())
+    for filename in files:
+        stat = os.stat(filename)
+        content = hashlib.blake2b(digest_size=16)
+        with open(filename, 'rb') as trace_file:
+            content.update(trace_file.read(TRACE_FINGERPRINT_SAMPLE))
+            if stat.st_size > TRACE_FINGERPRINT_SAMPLE:
+                trace_file.seek(max(TRACE_FINGERPRINT_SAMPLE, stat.st_size - TRACE_FINGERPRINT_SAMPLE))
+                content.update(trace_file.read())
+        fingerprint.update(f"{os.path.basename(filename)}:{stat.st_size}:{stat.st_mtime_ns}:{content.hexdigest()}\n".encode())
+    return fingerprint.hexdigest()
+
+def cache_lookup(cache_dir, key, suffix):
+    """ Returns the path of a cache entry or None if it does not exist """
+    entry = os.path.join(cache_dir, key + suffix)
+    if not os.path.isfile(entry):
+        return None
+    os.utime(entry) # mark as recently used
+    return entry
+
+def cache_store(cache_dir, key, suffix, export, data, cache_size=None):
+    """ Writes a cache entry using the given export function and evicts old entries afterwards """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key + suffix)
+    with atomic_write(entry) as temp_entry:
+        export(temp_entry, data)
+    evict_cache(cache_dir, TRACE_CACHE_SIZE if cache_size is None else cache_size, keep=entry)
+    return entry
+
+def evict_cache(cache_dir, cache_size, keep=None):
+    """ Removes the least recently used cache entries until the cache directory fits into cache_size bytes """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total_size <= cache_size:
+            break
+        if entry == keep:
+            continue
+        os.remove(entry)
+        total_size -= size
+
+def trace_chunk_name(filename):
+    """ Name of the trace chunk a file holds, independent of its encoding, e.g. 'instr_trace_0' for 'instr_trace_0.txt'
+        and for its binary conversion 'instr_trace_0.bin.gz' """
+    filename = strip_compression_suffix(filename)
+    if filename.endswith(BINARY_TRACE_SUFFIX):
+        filename = filename[:-len(BINARY_TRACE_SUFFIX)]
+    return os.path.splitext(filename)[0]
+
+def find_trace_files(path, check_filename):
+    """ Lists all trace files in a directory that pass the file name check, in the order they were written. Every chunk
+        is only read once: traces that were converted in place keep their text version, the binary one is preferred. """
     if not os.path.isdir(path):
         raise ValueError(f"'{path}' is not a valid directory!")
 
     directory = os.fsencode(path)
-    print(f"Parsing traces in '{path}'...")
-    files = []
-    basic_blocks = {}
-
-    # find files
+    chunks = {}
     for csv_file in os.listdir(directory):
         filename = os.fsdecode(csv_file)
         if not check_filename(filename):
             print(f"- skipping {filename}")
             continue
-        filename = f"{path}/{filename}"
-        files.append(filename)
-        with open(filename, 'r') as csv_file:
-            reader = csv.reader(csv_file, delimiter=delimiter)
-            next(reader) # skip header
-            prev_pc = 0
-            for row in reader:
-                #total_instructions += 1
-                col = row[br_target_idx].strip()
-                curr_pc = int(row[pc_idx], 16)
-                if col.startswith("-"):
-                    if prev_pc + 4 != curr_pc:
-                        basic_blocks[curr_pc] = 0
-                    prev_pc = curr_pc
-                    continue
-                basic_blocks[curr_pc + 4] = 0
-                basic_blocks[int(row[br_target_idx], 16)] = 0
-                prev_pc = curr_pc
+        chunk = trace_chunk_name(filename)
+        other = chunks.get(chunk)
+        if other is not None and strip_compression_suffix(other).endswith(BINARY_TRACE_SUFFIX):
+            print(f"- skipping {filename}, using {other}")
+            continue
+        if other is not None:
+            print(f"- skipping {other}, using {filename}")
+        chunks[chunk] = filename
+    return [f"{path}/{filename}" for filename in sorted(chunks.values(), key=trace_file_order)]
+
+def trace_size(path, check_filename):
+    """ Size in bytes of the trace files of a directory (as stored, i.e. compressed chunks with their compressed size) """
+    return sum(os.path.getsize(filename) for filename in find_trace_files(path, check_filename))
+
+def extract_basic_blocks_from_traces(path, check_filename, pc_idx, br_target_idx, delimiter=',', backend="python", jobs=1, edges=False, stats=None):
+    """ Extracts the basic blocks of a trace directory. If edges is set, the edge profile of the same pass is returned as
+        well (see block_edges_from_transitions). The number of parsed rows is added to stats (see count_parsed_rows). """
+    if not os.path.isdir(path):
+        raise ValueError(f"'{path}' is not a valid directory!")
+
+    print(f"Parsing traces in '{path}'...")
+    files = find_trace_files(path, check_filename)
+
+    # find leaders and count basic block usages in a single pass over each file
+    file_transitions = count_file_transitions(files, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=backend, jobs=jobs, stats=stats)
+    # connect the files so that a basic block that continues in the next file is not split up
+    transitions = link_trace_transitions(file_transitions)
+
+    basic_blocks = basic_blocks_from_transitions(transitions)
+    print(f"-> Found {len(basic_blocks)} basic blocks!")
+
+    if edges:
+        return basic_blocks, block_edges_from_transitions(transitions, basic_blocks)
+    return basic_blocks
+
+# Sampled traces only contain every period-th window of window consecutive instructions. Binary traces record their
+# sampling in the header (see binary_trace.py), so only the chunks that were actually sampled are scaled up.
+SAMPLING_Z = 1.96 # 95% confidence intervals
+
+def trace_file_sampling(filename):
+    """ Returns (period, window) recorded in the header of a binary trace file, or None for complete and text traces """
+    with open_trace_file(filename) as trace_file:
+        header = trace_file.read(TRACE_HEADER.size)
+    if not header.startswith(TRACE_MAGIC):
+        return None
+    return header_sampling(header)
+
+def trace_samplings(files, sampling=None):
+    """ Sampling of each trace file, files that do not record it (e.g. text traces) are sampled as given """
+    return [trace_file_sampling(filename) or sampling for filename in files]
+
+def basic_blocks_from_samples(sampled_transitions):
+    """ Estimates how often each basic block was entered from sampled traces, given as (transitions, (period, window))
+        per trace file, or (transitions, None) for complete traces. Consecutive samples are not necessarily consecutive
+        instructions, so leaders are only derived from sampled branches (their target and successor). Every sample stands
+        for period / window executed instructions, a block with n instructions and k samples was thus entered about
+        k * period / (window * n) times. Returns the estimates and their 95% confidence intervals, which assume that the
+        samples are independent (Poisson distributed). """
+    pc_estimates = collections.Counter()
+    pc_variances = collections.Counter()
+    leaders = set()
+    max_scale = 1
+    for transitions, sampling in sampled_transitions:
+        scale = 1 if sampling is None else sampling[0] / sampling[1]
+        max_scale = max(max_scale, scale)
+        for (_, pc, br_target), count in transitions.items():
+            pc_estimates[pc] += count * scale
+            pc_variances[pc] += count * scale * scale
+            if br_target is not None:
+                leaders.add(pc + 4)
+                leaders.add(br_target)
+    if pc_estimates:
+        leaders.add(min(pc_estimates))
+
+    pcs = sorted(pc_estimates)
+    prefix = list(itertools.accumulate((pc_estimates[pc] for pc in pcs), initial=0))
+    variance_prefix = list(itertools.accumulate((pc_variances[pc] for pc in pcs), initial=0))
+    leaders = sorted(leaders)
+    basic_blocks = {}
+    intervals = {}
+    for bb_start, bb_next in zip(leaders, leaders[1:] + [None]):
+        if bb_next is None:
+            # end of last basic block cannot be determined, only its first instruction is known
+            estimate, variance, instructions = pc_estimates[bb_start], pc_variances[bb_start], 1
+        else:
+            first, last = bisect.bisect_left(pcs, bb_start), bisect.bisect_left(pcs, bb_next)
+            estimate, variance = prefix[last] - prefix[first], variance_prefix[last] - variance_prefix[first]
+            instructions = (bb_next - bb_start) // 4
+        margin = SAMPLING_Z * math.sqrt(variance) if estimate else 3 * max_scale # rule of three for blocks without samples
+        basic_blocks[bb_start] = round(estimate / instructions)
+        intervals[bb_start] = (max(0, (estimate - margin) / instructions), (estimate + margin) / instructions)
+    return basic_blocks, intervals
+
+def extract_sampled_basic_blocks(path, check_filename, pc_idx, br_target_idx, delimiter=',', backend="python", jobs=1, sampling=None, stats=None):
+    """ Estimates the basic blocks of a trace directory with sampled chunks, see basic_blocks_from_samples. Chunks that do
+        not record their sampling are sampled as given (None if they are complete). """
+    if not os.path.isdir(path):
+        raise ValueError(f"'{path}' is not a valid directory!")
+
+    print(f"Parsing sampled traces in '{path}'...")
+    files = find_trace_files(path, check_filename)
+    file_transitions = count_file_transitions(files, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=backend, jobs=jobs, stats=stats)
+    sampled_transitions = [(transitions, file_sampling) for (transitions, _), file_sampling in zip(file_transitions, trace_samplings(files, sampling))]
+
+    basic_blocks, intervals = basic_blocks_from_samples(sampled_transitions)
+    print(f"-> Found {len(basic_blocks)} basic blocks in {sum(sum(transitions.values()) for transitions, _ in file_transitions)} samples!")
+    return basic_blocks, intervals
+
+def extract_basic_blocks_from_stream(path, pc_idx, br_target_idx, delimiter=',', edges=False, stats=None):
+    """ Extracts the basic blocks from a trace streamed through stdin ('-') or a named pipe, the trace is never stored.
+        If edges is set, the edge profile is returned as well. """
+    print(f"Parsing trace stream '{path}'...")
+    if path == '-':
+        transitions, last_pc = count_stream_transitions(open_trace_stream(sys.stdin.buffer), pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter)
+    else:
+        with open(path, 'rb') as stream:
+            transitions, last_pc = count_stream_transitions(open_trace_stream(stream), pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter)
+    transitions = link_trace_transitions([(transitions, last_pc)])
+    print(f"-> Processed {sum(transitions.values())} instructions")
+    count_parsed_rows(stats, sum(transitions.values()))
+
+    basic_blocks = basic_blocks_from_transitions(transitions)
+    print(f"-> Found {len(basic_blocks)} basic blocks!")
+
+    if edges:
+        return basic_blocks, block_edges_from_transitions(transitions, basic_blocks)
+    return basic_blocks
+
+def count_parsed_rows(stats, rows):
+    """ Adds the number of parsed trace rows to stats (e.g. a stage of the run report), if given """
+    if stats is not None:
+        stats["rows"] = stats.get("rows", 0) + rows
+
+def count_file_transitions(files, pc_idx, br_target_idx, delimiter=',', backend="python", jobs=1, stats=None):
+    """ Counts the transitions of each trace file, using a pool of worker processes if jobs > 1 """
+    count_transitions = functools.partial(TRACE_BACKENDS[backend], pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter)
+    if jobs > 1 and len(files) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(files))) as executor:
+            file_transitions = list(executor.map(count_transitions, files))
+    else:
+        file_transitions = [count_transitions(filename) for filename in files]
+    count_parsed_rows(stats, sum(sum(transitions.values()) for transitions, _ in file_transitions))
+    return file_transitions
+
+# With the static block map of the simulated binary (see elf_basic_blocks.py), the leaders are known in advance and the
+# traces only need to be searched for how often each pc was executed.
+def count_trace_pcs(filename, pc_idx, delimiter=','):
+    """ Counts how often each pc occurs in a trace file using a single pass """
+    if is_binary_trace(filename):
+        return count_binary_pcs(filename, pc_idx=pc_idx)
+    byte_delimiter = delimiter.encode()
+    field = b'[^' + re.escape(byte_delimiter) + b'\n]*'
+    pattern = re.compile(b'^' + re.escape(byte_delimiter).join([field] * pc_idx + [b'(' + field + b')']), re.MULTILINE)
+    raw_pcs = collections.Counter()
+    with open_trace_file(filename) as trace_file:
+        trace_file.readline() # skip header
+        for chunk in read_stream_chunks(trace_file):
+            raw_pcs.update(pattern.findall(chunk))
+    pc_counts = collections.Counter()
+    for pc, count in raw_pcs.items():
+        if pc.strip():
+            pc_counts[int(pc, 16)] += count
+    return pc_counts
+
+def count_trace_pcs_numpy(filename, pc_idx, delimiter=','):
+    """ Columnar variant of count_trace_pcs """
+    import numpy as np
+
+    if is_binary_trace(filename):
+        return count_binary_pcs(filename, pc_idx=pc_idx)
+    pc_counts = collections.Counter()
+    for window, newlines in numpy_trace_windows(np, filename):
+        line_starts = np.concatenate(([0], newlines[:-1] + 1))
+        line_ends = newlines
+        non_empty = line_ends > line_starts
+        line_starts, line_ends = line_starts[non_empty], line_ends[non_empty]
+        if line_starts.size == 0:
+            continue
+        delimiters = np.flatnonzero(window == ord(delimiter))
+        pc_starts, pc_ends = numpy_trace_fields(np, window, line_starts, line_ends, delimiters, pc_idx)
+        pcs, counts = np.unique(numpy_parse_hex(np, window, pc_starts, pc_ends), return_counts=True)
+        pc_counts.update(dict(zip(pcs.tolist(), counts.tolist())))
+    return pc_counts
+
+def count_binary_pcs(filename, pc_idx):
+    """ Variant of count_trace_pcs for binary traces, only the pc field of each record is unpacked """
+    with open_binary_trace(filename) as trace:
+        records = trace.iter_fields(pc_idx)
+        raw_pcs = collections.Counter()
+        while window := list(itertools.islice(records, BINARY_WINDOW_RECORDS)):
+            raw_pcs.update(window)
+        del records # releases the memory-mapped records
+    pc_counts = collections.Counter()
+    for (_, pc), count in raw_pcs.items():
+        pc_counts[pc] += count
+    return pc_counts
+
+PC_BACKENDS = {
+    "python": count_trace_pcs,
+    "numpy": count_trace_pcs_numpy,
+}
+
+def basic_blocks_from_pc_counts(pc_counts, block_map):
+    """ Counts how often each static basic block was entered. A block is entered as often as its first instruction is
+        executed; if the count changes within a block, it is entered in between by an indirect jump and split there.
+        Returns the entry counts and (end, instructions, symbol) of each block. Besides the executed blocks, the block
+        following each of them is kept (with count 0), like the leaders found in traces. """
+    basic_blocks = {}
+    block_info = {}
+    successors = []
+    for leader, next_leader in zip(block_map.leaders, block_map.leaders[1:] + [None]):
+        addresses = block_map.block_instructions(leader, next_leader)
+        start = prev = addresses[0]
+        blocks = []
+        for pc in addresses[1:]:
+            if pc_counts.get(pc, 0) != pc_counts.get(prev, 0):
+                blocks.append((start, prev))
+                start = pc
+            prev = pc
+        blocks.append((start, prev))
+        for idx, (start, end) in enumerate(blocks):
+            block_info[start] = (end, block_map.count_instructions(start, end), block_map.symbol(start))
+            if pc_counts.get(start, 0):
+                basic_blocks[start] = pc_counts[start]
+                successors.append(blocks[idx + 1][0] if idx + 1 < len(blocks) else next_leader)
+    for successor in successors:
+        if successor is not None and successor not in basic_blocks and successor in block_info:
+            basic_blocks[successor] = 0
+    block_info = {start: block_info[start] for start in basic_blocks}
+
+    unmapped = sum(count for pc, count in pc_counts.items() if pc not in block_map)
+    if unmapped:
+        print(f"WARNING: {unmapped} executed instructions are not part of the binary and were skipped!")
+    return basic_blocks, block_info
+
+def load_block_map(filename, cache_dir=None, cache_size=None):
+    """ Decodes the static basic blocks of a binary, or reuses them from the cache if the binary did not change """
+    if cache_dir is None:
+        return BlockMap(build_block_map(filename))
+    key = elf_fingerprint(filename)
+    if (entry := cache_lookup(cache_dir, key, ".blocks.json")) is not None and (block_map := read_block_map(entry)) is not None:
+        print(f"Reusing cached block map '{entry}'...")
+        return block_map
+    print(f"Decoding basic blocks of '{filename}'...")
+    data = build_block_map(filename)
+    cache_store(cache_dir, key, ".blocks.json", export_block_map, data, cache_size)
+    return BlockMap(data)
+
+def extract_basic_blocks_with_map(path, check_filename, pc_idx, block_map, delimiter=',', backend="python", jobs=1, stats=None):
+    """ Counts the entries of the static basic blocks of block_map in a trace directory """
+    print(f"Counting basic blocks in '{path}'...")
+    files = find_trace_files(path, check_filename)
+    count_pcs = functools.partial(PC_BACKENDS[backend], pc_idx=pc_idx, delimiter=delimiter)
+    pc_counts = collections.Counter()
+    if jobs > 1 and len(files) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(files))) as executor:
+            for partial_counts in executor.map(count_pcs, files):
+                pc_counts.update(partial_counts)
+    else:
+        for filename in files:
+            pc_counts.update(count_pcs(filename))
+    count_parsed_rows(stats, sum(pc_counts.values()))
+
+    basic_blocks, block_info = basic_blocks_from_pc_counts(pc_counts, block_map)
+    print(f"-> Found {len(basic_blocks)} basic blocks!")
+    return basic_blocks, block_info
+
+# The state of an incremental extraction only grows with the program, not with the trace: the trace files that were
+# completely written (a newer file exists) are folded into one aggregate of leaders and pc counts, only the last file,
+# which may still be written to, is kept separately and parsed again whenever it grows.
+EXTRACTION_STATE_VERSION = 2
+
+class ExtractionState:
+    """ Aggregate of the parsed trace files of an incremental extraction. files lists (name, size, mtime_ns) of the folded
+        files in trace order, tail holds the last file as (name, size, mtime_ns, leaders, pc_counts, last_pc) or None. """
+
+    def __init__(self, files=None, leaders=None, pc_counts=None, last_pc=0, tail=None):
+        self.files = files or []
+        self.leaders = leaders or set()
+        self.pc_counts = pc_counts or collections.Counter()
+        self.last_pc = last_pc
+        self.tail = tail
+
+    def fold(self, name, size, mtime_ns, leaders, pc_counts, last_pc):
+        """ Adds a completely written trace file to the aggregate """
+        self.files.append((name, size, mtime_ns))
+        self.leaders |= leaders
+        self.pc_counts.update(pc_counts)
+        if last_pc is not None:
+            self.last_pc = last_pc
+
+    def basic_blocks(self):
+        leaders, pc_counts = self.leaders, self.pc_counts
+        if self.tail is not None:
+            leaders, pc_counts = leaders | self.tail[3], pc_counts + self.tail[4]
+        return {leader: pc_counts[leader] for leader in leaders}
+
+def read_extraction_state(filepath, config):
+    """ Reads the state of an incremental extraction, the state is discarded if it was created with another configuration """
+    if not os.path.isfile(filepath):
+        return ExtractionState()
+    with open(filepath, 'r') as state_file:
+        state = json.load(state_file)
+    if state.get("version") != EXTRACTION_STATE_VERSION or state.get("config") != config:
+        print(f"- discarding '{filepath}', it was created with another configuration")
+        return ExtractionState()
+    tail = state["tail"]
+    if tail is not None:
+        tail = (tail["name"], tail["size"], tail["mtime_ns"], set(tail["leaders"]), collections.Counter(dict(tail["pc_counts"])), tail["last_pc"])
+    return ExtractionState([tuple(entry) for entry in state["files"]], set(state["leaders"]), collections.Counter(dict(state["pc_counts"])), state["last_pc"], tail)
+
+def export_extraction_state(filepath, config, state):
+    tail = None
+    if state.tail is not None:
+        name, size, mtime_ns, leaders, pc_counts, last_pc = state.tail
+        tail = {"name": name, "size": size, "mtime_ns": mtime_ns, "leaders": sorted(leaders), "pc_counts": sorted(pc_counts.items()), "last_pc": last_pc}
+    data = {
+        "version": EXTRACTION_STATE_VERSION,
+        "config": config,
+        "files": state.files,
+        "leaders": sorted(state.leaders),
+        "pc_counts": sorted(state.pc_counts.items()),
+        "last_pc": state.last_pc,
+        "tail": tail,
+    }
+    with atomic_write(filepath) as temp_filepath, open(temp_filepath, 'w') as state_file:
+        json.dump(data, state_file)
+
+def extract_basic_blocks_incremental(path, check_filename, pc_idx, br_target_idx, delimiter=',', backend="python", jobs=1, stats=None):
+    """ Extracts the basic blocks from the traces, but only parses trace files that were added or modified since the last call.
+        The aggregate of the parsed files (see ExtractionState) is kept in basic_blocks_state.json next to the traces. If a
+        folded file changed, all files are parsed again. """
+    if not os.path.isdir(path):
+        raise ValueError(f"'{path}' is not a valid directory!")
+
+    state_path = f"{path}/../basic_blocks_state.json"
+    config = {"pc_idx": pc_idx, "br_target_idx": br_target_idx, "delimiter": delimiter}
+    state = read_extraction_state(state_path, config)
+
+    print(f"Parsing new traces in '{path}'...")
+    files = []
+    for filename in find_trace_files(path, check_filename):
+        stat = os.stat(filename)
+        files.append((os.path.basename(filename), stat.st_size, stat.st_mtime_ns, filename))
+    if [entry[:3] for entry in files[:len(state.files)]] != state.files:
+        print("- folded trace files were modified, parsing all trace files again")
+        state = ExtractionState()
+    remaining = files[len(state.files):]
+    # the tail is reused if it did not grow since it was parsed, as long as it is not folded it is parsed with the last
+    # pc of the folded files
+    tail = state.tail if remaining and state.tail is not None and state.tail[:3] == remaining[0][:3] else None
+    pending = remaining[1:] if tail is not None else remaining
+    print(f"-> {len(pending)} of {len(files)} trace files are new or modified")
+
+    file_transitions = count_file_transitions([filename for _, _, _, filename in pending], pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=backend, jobs=jobs, stats=stats)
+    parsed = [tail] if tail is not None else []
+    prev_pc = tail[5] if tail is not None and tail[5] is not None else state.last_pc
+    for (name, size, mtime_ns, _), (transitions, last_pc) in zip(pending, file_transitions):
+        leaders, pc_counts = set(), collections.Counter()
+        add_transition_leaders(transitions, leaders, pc_counts, last_pc=prev_pc)
+        parsed.append((name, size, mtime_ns, leaders, pc_counts, last_pc))
+        if last_pc is not None:
+            prev_pc = last_pc
+    for entry in parsed[:-1]:
+        state.fold(*entry)
+    state.tail = parsed[-1] if parsed else None
+    export_extraction_state(state_path, config, state)
+
+    basic_blocks = state.basic_blocks()
     print(f"-> Found {len(basic_blocks)} basic blocks!")
 
-    # count how often each basic blocks is used, accumulate assembly trace for basic block
-    print("Extracting basic block usages...")
-    for file in files:
-        with open(file, 'r') as csv_file:
-            reader = csv.reader(csv_file, delimiter=delimiter)
-            next(reader) # skip header
-            for row in reader:
-                current_pc = int(row[pc_idx], 16)
-                if current_pc in basic_blocks:
-                    basic_blocks[current_pc] += 1
+    return basic_blocks
 
+def load_basic_blocks(path, check_filename, pc_idx, br_target_idx, delimiter=',', backend="python", jobs=1, cache_dir=None, cache_size=None, stats=None):
+    """ Extracts the basic blocks from the traces, or reuses them from the cache if the traces did not change """
+    if cache_dir is None:
+        return extract_basic_blocks_from_traces(path, check_filename=check_filename, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=backend, jobs=jobs, stats=stats)
+    files = find_trace_files(path, check_filename)
+    # the backend is not part of the key, all backends yield the same basic blocks
+    key = trace_fingerprint(files, kind="basic_blocks", pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter)
+    if (entry := cache_lookup(cache_dir, key, ".bbdb")) is not None:
+        print(f"Reusing cached basic blocks '{entry}'...")
+        return extract_basic_blocks_db(entry)
+    basic_blocks = extract_basic_blocks_from_traces(path, check_filename=check_filename, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=backend, jobs=jobs, stats=stats)
+    cache_store(cache_dir, key, ".bbdb", export_basic_blocks_db, basic_blocks, cache_size)
     return basic_blocks
 
-def extract_basic_blocks_csv(filepath):
+def extract_basic_blocks_csv(filepath, with_block_info=False):
+    """ Reads exported basic blocks. If with_block_info is set, (basic_blocks, block_info) is returned, block_info holds
+        the exact ends, instructions and symbols of blocks exported with a binary (--elf) and is None otherwise. """
     if not os.path.exists(filepath):
         raise ValueError(f"'{filepath}' does not exist!")
 
@@ -60,43 +977,119 @@ def extract_basic_blocks_csv(filepath):
     print(f"Parsing traces in '{filepath}'...")
 
     basic_blocks = {}
+    block_info = {}
     with open(filepath, 'r') as csv_file:
         reader = csv.reader(csv_file, delimiter=',')
-        next(reader) # skip header
+        header = next(reader)
+        # only exports with a binary have the symbol column, their ends are exact
+        exact = len(header) > 4
         for row in reader:
-            basic_blocks[int(row[0], 16)] = int(row[3])
+            bb_start = int(row[0], 16)
+            basic_blocks[bb_start] = int(row[3])
+            if exact:
+                block_info[bb_start] = (int(row[1], 16), int(row[2]), row[4].strip())
 
+    if with_block_info:
+        return basic_blocks, block_info if exact else None
     return basic_blocks
 
-def extract_asm_from_traces(address_start, length, path, check_filename, pc_idx, asm_idx, delimiter=','):
-    if not os.path.isdir(path):
-        raise ValueError(f"'{path}' is not a valid directory!")
+def build_asm_index(path, check_filename, pc_idx, asm_idx, delimiter=','):
+    """ Maps each executed pc to its assembly using a single pass over the traces """
+    print(f"Indexing assembly in '{path}'...")
+    pattern = trace_record_pattern(pc_idx, asm_idx, delimiter.encode())
+    asm_index = {}
+    for filename in find_trace_files(path, check_filename):
+        if is_binary_trace(filename):
+            index_binary_asm(filename, pc_idx, asm_idx, asm_index)
+            continue
+        for chunk in read_trace_chunks(filename):
+            records = pattern.findall(chunk)
+            if pc_idx > asm_idx:
+                records = [(pc, asm) for asm, pc in records]
+            # the assembly of a pc never changes, only its first occurrence in each chunk needs to be decoded
+            for pc, asm in dict.fromkeys(records):
+                asm_index.setdefault(int(pc, 16), asm.strip().decode())
+    print(f"-> Indexed assembly of {len(asm_index)} instructions!")
+    return asm_index
 
-    directory = os.fsencode(path)
+def index_binary_asm(filename, pc_idx, asm_idx, asm_index):
+    """ Adds the assembly of all pcs of a binary trace to asm_index """
+    with open_binary_trace(filename) as trace:
+        records = trace.iter_fields(pc_idx, asm_idx)
+        while window := list(itertools.islice(records, BINARY_WINDOW_RECORDS)):
+            for _, first, second in dict.fromkeys(window):
+                pc, asm = (first, second) if pc_idx < asm_idx else (second, first)
+                if pc not in asm_index:
+                    asm_index[pc] = trace.string(asm_idx, asm).strip()
+        del records
 
-    assembly = []
-    # find files
-    for csv_file in os.listdir(directory):
-        filename = os.fsdecode(csv_file)
-        if not check_filename(filename):
-            print(f"- skipping {filename}")
-            continue
-        filename = f"{path}/{filename}"
-        with open(filename, 'r') as csv_file:
-            reader = csv.reader(csv_file, delimiter=delimiter)
-            next(reader) # skip header
-            found_pc = False
-            for row in reader:
-                pc  = int(row[pc_idx], 16)
-                if pc == address_start:
-                    found_pc = True
-                if found_pc:
-                    if length <= 0:
-                        return assembly
-                    trace = row[asm_idx].strip()
-                    assembly.append(trace)
-                    length -= 1
-    raise RuntimeError(f"Failed to find assembly for '{hex(address_start)}'")
+def export_asm_index(path, asm_index):
+    with open(path, 'w', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(["pc", "assembly"])
+        writer.writerows([f'0x{pc:08x}', asm_index[pc]] for pc in sorted(asm_index))
+
+def extract_asm_index_csv(filepath):
+    if not os.path.exists(filepath):
+        raise ValueError(f"'{filepath}' does not exist!")
+
+    asm_index = {}
+    with open(filepath, 'r', newline='') as csv_file:
+        reader = csv.reader(csv_file, delimiter=',')
+        next(reader) # skip header
+        for row in reader:
+            asm_index[int(row[0], 16)] = row[1]
+
+    return asm_index
+
+def load_asm_index(path, check_filename, pc_idx, asm_idx, delimiter=',', cache_dir=None, cache_size=None):
+    """ Builds the assembly index of the traces, or reuses it from the cache if the traces did not change """
+    if cache_dir is None:
+        return build_asm_index(path, check_filename=check_filename, pc_idx=pc_idx, asm_idx=asm_idx, delimiter=delimiter)
+    files = find_trace_files(path, check_filename)
+    key = trace_fingerprint(files, kind="asm_index", pc_idx=pc_idx, asm_idx=asm_idx, delimiter=delimiter)
+    if (entry := cache_lookup(cache_dir, key, ".asm.csv")) is not None:
+        print(f"Reusing cached assembly index '{entry}'...")
+        return extract_asm_index_csv(entry)
+    asm_index = build_asm_index(path, check_filename=check_filename, pc_idx=pc_idx, asm_idx=asm_idx, delimiter=delimiter)
+    cache_store(cache_dir, key, ".asm.csv", export_asm_index, asm_index, cache_size)
+    return asm_index
+
+UNKNOWN_ASM = "unknown # []" # placeholder for instructions that were not sampled
+
+def index_addresses(address_start, address_next, executed_pcs):
+    """ Addresses of the instructions from address_start up to address_next, walked along the sorted pcs of the assembly
+        index, so instructions of any length (e.g. compressed ones) are found. Instructions between the executed pcs
+        (not sampled) are assumed to be 4 bytes long and returned as None. """
+    addresses = []
+    pc = address_start
+    for address in executed_pcs[bisect.bisect_left(executed_pcs, address_start):bisect.bisect_left(executed_pcs, address_next)]:
+        addresses += [None] * ((address - pc) // 4)
+        addresses.append(address)
+        pc = address + 4
+    addresses += [None] * ((address_next - pc) // 4)
+    return addresses
+
+def extract_asm_from_index(address_start, address_next, asm_index, executed_pcs, strict=True):
+    addresses = index_addresses(address_start, address_next, executed_pcs)
+    if not strict:
+        return [asm_index.get(pc, UNKNOWN_ASM) for pc in addresses]
+    if not addresses or None in addresses:
+        raise RuntimeError(f"Failed to find assembly for '{hex(address_start)}'")
+    return [asm_index[pc] for pc in addresses]
+
+def block_addresses(bb_start, bb_end, block_map=None, executed_pcs=None):
+    """ Addresses of the instructions of a block with an exact end, taken from the binary or, without it, from the sorted
+        pcs of the assembly index (every instruction of an entered block was executed) """
+    if block_map is not None:
+        return block_map.instructions_between(bb_start, bb_end)
+    return executed_pcs[bisect.bisect_left(executed_pcs, bb_start):bisect.bisect_right(executed_pcs, bb_end)]
+
+def extract_asm_from_addresses(addresses, asm_index):
+    try:
+        return [asm_index[pc] for pc in addresses]
+    except KeyError as e:
+        raise RuntimeError(f"Failed to find assembly for '{hex(e.args[0])}'")
 
 def parse_asm(trace):
     idx = trace.index("#")
@@ -107,37 +1100,215 @@ def parse_asm(trace):
     registers = [ r.strip() for r in registers]
     return (instr_name, registers)
 
-def export_basic_blocks(path, basic_blocks):
-    basic_block_addresses = list(basic_blocks.keys())
-    basic_block_addresses.sort(key=lambda key: key)
+# Instruction classes of the dynamic instruction mix, by mnemonic (without the 'c.' prefix of compressed instructions).
+# Floating-point instructions that are no loads or stores are 'float', all remaining instructions are 'alu'.
+INSTRUCTION_CLASSES = {
+    "branch": {"beq", "bne", "blt", "bge", "bltu", "bgeu", "beqz", "bnez", "blez", "bgez", "bltz", "bgtz", "bgt", "ble", "bgtu", "bleu"},
+    "jump": {"jal", "jalr", "j", "jr", "ret", "call", "tail"},
+    "load": {"lb", "lh", "lw", "ld", "lbu", "lhu", "lwu", "flw", "fld", "lwsp", "ldsp", "flwsp", "fldsp"},
+    "store": {"sb", "sh", "sw", "sd", "fsw", "fsd", "swsp", "sdsp", "fswsp", "fsdsp"},
+    "muldiv": {"mul", "mulh", "mulhsu", "mulhu", "mulw", "div", "divu", "divw", "divuw", "rem", "remu", "remw", "remuw"},
+    "csr": {"csrrw", "csrrs", "csrrc", "csrrwi", "csrrsi", "csrrci", "csrr", "csrw", "csrs", "csrc", "csrwi", "csrsi", "csrci"},
+    "system": {"ecall", "ebreak", "mret", "sret", "uret", "wfi", "fence", "fence.i", "sfence.vma"},
+}
 
-    string = "start, end, instructions, count\n"
+def instruction_class(mnemonic):
+    name = mnemonic.replace('_', '.')
+    if name.startswith("c."):
+        name = name[2:]
+    for instruction_class, names in INSTRUCTION_CLASSES.items():
+        if name in names:
+            return instruction_class
+    if name == "unknown":
+        return "unknown"
+    if name.startswith('f'):
+        return "float"
+    return "alu"
 
-    next_idx = 0
-    for bb_start in basic_block_addresses[:-1]: # skip last entry
-        next_idx += 1
-        count  = basic_blocks[bb_start]
-        bb_end = basic_block_addresses[next_idx] - 4
-        ninstructions = ((bb_end - bb_start) // 4) + 1
-        string += f'0x{bb_start:08x}, 0x{bb_end:08x}, {ninstructions}, {count}\n'
+def intern_mnemonics(asm_index):
+    """ Interns the mnemonic of every indexed pc as a small integer, the assembly of each pc is only split once. Returns
+        the mnemonics (by id) and the mnemonic id of each pc. """
+    ids = {}
+    pc_mnemonics = {}
+    for pc, asm in asm_index.items():
+        pc_mnemonics[pc] = ids.setdefault(asm.split('#', 1)[0].strip().lower(), len(ids))
+    return list(ids), pc_mnemonics
+
+def instruction_mix(basic_blocks, asm_index, block_info=None, block_map=None):
+    """ Computes the dynamic instruction mix: the mnemonics of each basic block are counted once and weighted by how often
+        the block was entered. Instructions without assembly (e.g. in sampled traces) are 'unknown'. Returns a dict with
+        the mnemonics, their classes, the dynamic count of each mnemonic (by id) and the weighted mnemonic counts of each
+        block. """
+    mnemonics, pc_mnemonics = intern_mnemonics(asm_index)
+    unknown = len(mnemonics)
+    mnemonics.append("unknown")
+    counts = [0] * len(mnemonics)
+    blocks = {}
+    basic_block_addresses = sorted(basic_blocks)
+    executed_pcs = sorted(asm_index) if block_map is None else None
+    for bb_start, bb_next in zip(basic_block_addresses, basic_block_addresses[1:] + [None]):
+        count = basic_blocks[bb_start]
+        if count == 0:
+            continue
+        if block_info is not None:
+            addresses = block_addresses(bb_start, block_info[bb_start][0], block_map, executed_pcs)
+        elif bb_next is None:
+            continue # end of last basic block cannot be determined without the binary
+        else:
+            addresses = index_addresses(bb_start, bb_next, executed_pcs)
+        block_mix = collections.Counter(pc_mnemonics.get(pc, unknown) for pc in addresses)
+        for mnemonic, n in block_mix.items():
+            block_mix[mnemonic] = n * count
+            counts[mnemonic] += n * count
+        blocks[bb_start] = block_mix
+    return {"mnemonics": mnemonics, "classes": [instruction_class(mnemonic) for mnemonic in mnemonics], "counts": counts, "blocks": blocks}
+
+def class_counts(mix):
+    counts = collections.Counter()
+    for instruction_class, count in zip(mix["classes"], mix["counts"]):
+        counts[instruction_class] += count
+    return counts
+
+def export_instruction_mix(path, mix):
+    total = sum(mix["counts"]) or 1
+    lines = ["kind, name, count, share\n"]
+    for instruction_class, count in class_counts(mix).most_common():
+        if count:
+            lines.append(f'class, {instruction_class}, {count}, {count / total:.6f}\n')
+    for mnemonic, count in sorted(zip(mix["mnemonics"], mix["counts"]), key=lambda entry: -entry[1]):
+        if count:
+            lines.append(f'mnemonic, {mnemonic}, {count}, {count / total:.6f}\n')
+    with open(path, 'w') as out_file:
+        out_file.write("".join(lines))
 
+def export_block_instruction_mix(path, mix):
+    lines = ["block, mnemonic, class, count\n"]
+    for bb_start, block_mix in sorted(mix["blocks"].items()):
+        for mnemonic, count in block_mix.most_common():
+            lines.append(f'0x{bb_start:08x}, {mix["mnemonics"][mnemonic]}, {mix["classes"][mnemonic]}, {count}\n')
     with open(path, 'w') as out_file:
-        out_file.write(string)
+        out_file.write("".join(lines))
 
-def count_total_instructions(basic_blocks):
-    basic_block_addresses = list(basic_blocks.keys())
-    basic_block_addresses.sort(key=lambda key: key)
+def print_instruction_mix(mix, top=10):
+    total = sum(mix["counts"]) or 1
+    print("Instruction mix:")
+    print("  " + " | ".join(f"{instruction_class} {count * 100 / total:.1f}%" for instruction_class, count in class_counts(mix).most_common() if count))
+    mnemonics = sorted(zip(mix["mnemonics"], mix["counts"]), key=lambda entry: -entry[1])[:top]
+    print("  " + " | ".join(f"{mnemonic} {count * 100 / total:.1f}%" for mnemonic, count in mnemonics if count))
 
-    total_instructions = 0
-    next_idx = 0
-    for bb_start in basic_block_addresses[:-1]: # skip last entry
-        next_idx += 1
+def block_instruction_counts(basic_blocks, block_info=None):
+    """ Number of instructions of every basic block whose size is known, sorted by start address: exact with block_info,
+        otherwise derived from the next leader (4 bytes per instruction, the last block is skipped) """
+    basic_block_addresses = sorted(basic_blocks)
+    if block_info is not None:
+        return {bb_start: block_info[bb_start][1] for bb_start in basic_block_addresses}
+    return {bb_start: (bb_next - bb_start) // 4 for bb_start, bb_next in zip(basic_block_addresses, basic_block_addresses[1:])}
+
+def export_basic_blocks(path, basic_blocks, block_info=None):
+    """ Writes the basic blocks as csv. With block_info (see basic_blocks_from_pc_counts), the exact ends and the symbol of
+        every block are written, otherwise the ends are derived from the next leader and the last block is skipped. """
+    basic_block_addresses = sorted(basic_blocks)
+
+    if block_info is not None:
+        lines = ["start, end, instructions, count, symbol\n"]
+        for bb_start in basic_block_addresses:
+            bb_end, ninstructions, symbol = block_info[bb_start]
+            lines.append(f'0x{bb_start:08x}, 0x{bb_end:08x}, {ninstructions}, {basic_blocks[bb_start]}, {symbol}\n')
+        with open(path, 'w') as out_file:
+            out_file.write("".join(lines))
+        return
+
+    lines = ["start, end, instructions, count\n"]
+    for bb_start, ninstructions in block_instruction_counts(basic_blocks).items():
         count  = basic_blocks[bb_start]
-        bb_end = basic_block_addresses[next_idx] - 4
-        ninstructions = ((bb_end - bb_start) // 4) + 1
-        total_instructions += ninstructions * count
+        bb_end = bb_start + 4 * (ninstructions - 1)
+        lines.append(f'0x{bb_start:08x}, 0x{bb_end:08x}, {ninstructions}, {count}\n')
 
-    return total_instructions
+    with open(path, 'w') as out_file:
+        out_file.write("".join(lines))
+
+# Binary basic block database: header (magic, version, reserved, number of blocks) followed by the columns start, end,
+# instructions and count, each an array of little-endian int64 values sorted by start address. Unlike the csv export,
+# the last basic block is kept, its end and instructions are 0 as they cannot be determined.
+# The flags of the header mark databases whose ends and instructions are exact (extracted with a binary).
+BB_DB_MAGIC = b'PSWBBDB\0'
+BB_DB_VERSION = 1
+BB_DB_HEADER = struct.Struct('<8sIIQ')
+BB_DB_COLUMNS = ("start", "end", "instructions", "count")
+BB_DB_EXACT_ENDS = 0x1
+
+def export_basic_blocks_db(path, basic_blocks, block_info=None):
+    starts = array.array('q', sorted(basic_blocks))
+    if block_info is not None:
+        ends = array.array('q', [block_info[bb_start][0] for bb_start in starts])
+        instructions = array.array('q', [block_info[bb_start][1] for bb_start in starts])
+    else:
+        instructions = array.array('q', block_instruction_counts(basic_blocks).values())
+        ends = array.array('q', [bb_start + 4 * (ninstructions - 1) for bb_start, ninstructions in zip(starts, instructions)])
+        if starts:
+            ends.append(0)
+            instructions.append(0)
+    counts = array.array('q', [basic_blocks[bb_start] for bb_start in starts])
+
+    with open(path, 'wb') as out_file:
+        flags = BB_DB_EXACT_ENDS if block_info is not None else 0
+        out_file.write(BB_DB_HEADER.pack(BB_DB_MAGIC, BB_DB_VERSION, flags, len(starts)))
+        for column in (starts, ends, instructions, counts):
+            if sys.byteorder != 'little':
+                column.byteswap()
+            column.tofile(out_file)
+
+def is_basic_blocks_db(filepath):
+    with open(filepath, 'rb') as in_file:
+        return in_file.read(len(BB_DB_MAGIC)) == BB_DB_MAGIC
+
+def read_basic_blocks_db(filepath, with_flags=False):
+    """ Memory-maps a basic block database and returns its columns (see BB_DB_COLUMNS) as int64 sequences. If with_flags
+        is set, (columns, flags) is returned. """
+    with open(filepath, 'rb') as in_file:
+        db = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(db) < BB_DB_HEADER.size:
+        raise ValueError(f"'{filepath}' is not a basic block database!")
+    magic, version, flags, nblocks = BB_DB_HEADER.unpack_from(db)
+    if magic != BB_DB_MAGIC:
+        raise ValueError(f"'{filepath}' is not a basic block database!")
+    if version != BB_DB_VERSION:
+        raise ValueError(f"'{filepath}' has unsupported version {version} (expected {BB_DB_VERSION})!")
+    column_size = nblocks * 8
+    if len(db) != BB_DB_HEADER.size + len(BB_DB_COLUMNS) * column_size:
+        raise ValueError(f"'{filepath}' is truncated!")
+
+    columns = []
+    for idx in range(len(BB_DB_COLUMNS)):
+        offset = BB_DB_HEADER.size + idx * column_size
+        if sys.byteorder == 'little':
+            # zero-copy view into the mapped file
+            columns.append(memoryview(db)[offset:offset + column_size].cast('q'))
+        else:
+            column = array.array('q', db[offset:offset + column_size])
+            column.byteswap()
+            columns.append(column)
+    if with_flags:
+        return columns, flags
+    return columns
+
+def extract_basic_blocks_db(filepath, with_block_info=False):
+    """ Reads a basic block database, see extract_basic_blocks_csv for with_block_info. Databases do not store symbols. """
+    if not os.path.exists(filepath):
+        raise ValueError(f"'{filepath}' does not exist!")
+
+    print(f"Reading basic block database '{filepath}'...")
+    (starts, ends, instructions, counts), flags = read_basic_blocks_db(filepath, with_flags=True)
+    starts = starts.tolist()
+    basic_blocks = dict(zip(starts, counts.tolist()))
+    if not with_block_info:
+        return basic_blocks
+    if not flags & BB_DB_EXACT_ENDS:
+        return basic_blocks, None
+    return basic_blocks, {bb_start: (bb_end, ninstructions, "") for bb_start, bb_end, ninstructions in zip(starts, ends.tolist(), instructions.tolist())}
+
+def count_total_instructions(basic_blocks, block_info=None):
+    return sum(ninstructions * basic_blocks[bb_start] for bb_start, ninstructions in block_instruction_counts(basic_blocks, block_info).items())
 
 def main():
 
@@ -159,6 +1330,12 @@ def main():
             return path
         raise argparse.ArgumentTypeError(f"'{path}' is not a valid path!")
 
+    def trace_source_type(path):
+        """" Enforces that an argument is a directory, a named pipe or '-' """
+        if is_trace_stream(path) or os.path.isdir(path):
+            return path
+        raise argparse.ArgumentTypeError(f"'{path}' is neither a valid directory nor a named pipe!")
+
     def positive_number(num):
         """" Enforces that an argument is a positive number """
         num = float(num)
@@ -169,21 +1346,52 @@ def main():
         else:
             return num
 
+    def positive_integer(num):
+        """" Enforces that an argument is a positive integer """
+        num = positive_number(num)
+        if not isinstance(num, int):
+            raise argparse.ArgumentTypeError(f"expected positive integer!")
+        return num
+
+    def sampling_type(value):
+        """" Enforces that an argument is a sampling period, optionally followed by the window size (PERIOD[:WINDOW]) """
+        period, _, window = value.partition(':')
+        try:
+            period, window = int(period), int(window or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected PERIOD[:WINDOW], got '{value}'!")
+        if window < 1 or period < window:
+            raise argparse.ArgumentTypeError(f"expected 1 <= WINDOW <= PERIOD!")
+        return (period, window)
+
     argParser = argparse.ArgumentParser()
-    argParser.add_argument("-tp" , nargs=1, type=exisiting_dir_type, help="Directory to performance traces.")
+    argParser.add_argument("-tp" , nargs=1, type=trace_source_type, help="Directory to performance traces. Pass a named pipe or '-' (stdin) to stream the trace instead.")
     argParser.add_argument("-ta" , nargs=1, type=exisiting_dir_type, help="Directory to assembly traces.")
-    argParser.add_argument("-ti" , nargs=1, type=exisiting_dir_type, help="Directory to instruction traces.")
-    argParser.add_argument("-csv", nargs=1, type=exisiting_file_type, help="Directory to extracted basic blocks.")
+    argParser.add_argument("-ti" , nargs=1, type=trace_source_type, help="Directory to instruction traces. Pass a named pipe or '-' (stdin) to stream the trace instead.")
+    argParser.add_argument("-csv", nargs=1, type=exisiting_file_type, help="Path to extracted basic blocks (basic_blocks.csv or basic_blocks.bbdb).")
     argParser.add_argument("-c", "--cut-off", nargs="?", type=positive_number, const=100, default=100, help="Filters any basic block that was entered at least this often.")
     argParser.add_argument("-p", "--print", action="store_true", help="If this flag is set, all basic blocks that match the cut-off are printed to stdout.")
     argParser.add_argument("-a", "--asm", action="store_true", help="If this flag is set and print is set, the assembly code is printed to stdout as well.")
     argParser.add_argument("-e", "--export", nargs=1, type=valid_path_type, help="Directory to export extracted basic blocks to.")
+    argParser.add_argument("-j", "--jobs", nargs="?", type=positive_integer, const=os.cpu_count(), default=1, help="Number of trace files that are parsed in parallel. Uses all cores if no number is given.")
+    argParser.add_argument("-i", "--incremental", action="store_true", help="If this flag is set, only trace files that were added or modified since the last call are parsed. The parse state is kept next to the traces.")
+    argParser.add_argument("--cache-dir", nargs=1, type=valid_path_type, help="Directory to cache extracted basic blocks and assembly in. Defaults to 'cache' next to the trace directories.")
+    argParser.add_argument("--cache-size", type=positive_number, default=TRACE_CACHE_SIZE / (1 << 20), help="Maximum size of the cache directory in MiB, least recently used entries are evicted.")
+    argParser.add_argument("--no-cache", action="store_true", help="If this flag is set, traces are always parsed and nothing is cached.")
+    argParser.add_argument("-b", "--backend", choices=TRACE_BACKENDS.keys(), default="python", help="Backend used to parse the traces. The numpy backend parses memory-mapped traces column-wise and requires numpy.")
+    argParser.add_argument("-m", "--mix", action="store_true", help="If this flag is set, the dynamic instruction mix (per mnemonic, instruction class and basic block) is exported to instruction_mix.csv and instruction_mix_blocks.csv. Requires the assembly traces.")
+    argParser.add_argument("--edges", action="store_true", help="If this flag is set, the edges between basic blocks are counted as well. Exports the edges and hot paths (superblocks) ranked by their dynamic instruction coverage, which are printed alongside the basic blocks that match the cut-off.")
+    argParser.add_argument("--elf", nargs=1, type=exisiting_file_type, help="RISC-V ELF binary the traces were generated with. Its basic blocks are decoded statically (and cached), the traces are only searched for their entries.")
+    argParser.add_argument("--report", help=f"Json file the run report (wall and CPU time, I/O volume and peak RSS of every stage) is written to. Defaults to a new file in ${RUN_REPORT_DIR} if set.")
+    argParser.add_argument("--profile", help="Profiles the parsing and assembly extraction with cProfile and writes the statistics to this file (readable with pstats), the hotspots are added to the run report. Worker processes (--jobs) are not profiled.")
+    argParser.add_argument("-s", "--sampling", type=sampling_type, help="Treats the traces as sampled: a window of WINDOW (default: 1) consecutive instructions every PERIOD instructions (PERIOD[:WINDOW]). Binary traces that record their sampling in the header are scaled by it instead. Block counts are estimated.")
     args = argParser.parse_args()
 
     print(args)
+    report = RunReport("extract_basic_blocks", path=args.report, profile=args.profile)
 
     path = None
-    am_path = None
+    asm_path = None
     export_path = None
 
     do_extract_from_trace = True
@@ -194,7 +1402,7 @@ def main():
         asm_idx = 2
         br_target_idx = 7
         delimiter = asm_delimiter = ','
-        check_filename = asm_check_filename = lambda f: f.endswith(".txt") and "instr_trace_" in f
+        check_filename = asm_check_filename = lambda f: strip_compression_suffix(f).endswith((".txt", ".bin")) and "instr_trace_" in f
         if args.tp is not None and args.tp is not None:
             argParser.error("Incompatible arguments: Either pass directory to performance traces or directory to instruction traces.")
     # path to performance traces, contains only br info
@@ -203,7 +1411,7 @@ def main():
         pc_idx = 0
         br_target_idx = 1
         delimiter = '|'
-        check_filename = lambda f: f.endswith(".csv") and "_trace_" in f
+        check_filename = lambda f: strip_compression_suffix(f).endswith(".csv") and "_trace_" in f
     # path to extracted traces
     elif args.csv is not None:
         [path] = args.csv
@@ -216,7 +1424,7 @@ def main():
         asm_idx = 1
         asm_pc_idx = 0
         asm_delimiter = ';'
-        asm_check_filename = lambda f: f.endswith(".txt") and "asm_trace_" in f
+        asm_check_filename = lambda f: strip_compression_suffix(f).endswith((".txt", ".bin")) and "asm_trace_" in f
 
     # create export path for basic blocks
     if args.export is not None:
@@ -226,65 +1434,200 @@ def main():
         export_asm_path = Path(export_path)
         export_asm_path.mkdir(exist_ok=True)
 
-    if args.asm and asm_path is None:
+    if (args.asm or args.mix) and asm_path is None:
         argParser.error("Must provide directory to traces that contain the assembly code!")
 
-    if do_extract_from_trace:
-        # parse traces and extract basic blocks
-        basic_blocks = extract_basic_blocks_from_traces(path, check_filename=check_filename, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter)
-        export_basic_blocks(f"{path}/../basic_blocks.csv", basic_blocks)
+    if args.backend == "numpy" and importlib.util.find_spec("numpy") is None:
+        argParser.error("The numpy backend requires numpy to be installed!")
+
+    stream = do_extract_from_trace and is_trace_stream(path)
+    if stream:
+        if asm_path == path and (args.asm or export_path is not None):
+            argParser.error("Assembly cannot be re-read from a trace stream, pass a directory to assembly traces with -ta!")
+        if args.incremental:
+            argParser.error("Incompatible arguments: Trace streams cannot be extracted incrementally.")
+        if args.backend != "python":
+            argParser.error(f"Incompatible arguments: Trace streams are only supported by the python backend.")
+        if args.sampling is not None:
+            argParser.error("Incompatible arguments: Sampled traces cannot be streamed.")
+
+    # distinct samplings of the trace chunks, counts are estimated if any chunk is sampled
+    samplings = {args.sampling} - {None}
+    if do_extract_from_trace and not stream:
+        samplings = set(trace_samplings(find_trace_files(path, check_filename), args.sampling)) - {None}
+    intervals = None
+    if samplings:
+        if not do_extract_from_trace:
+            argParser.error("Sampling only applies to traces!")
+        if args.incremental:
+            argParser.error("Incompatible arguments: Sampled traces cannot be extracted incrementally.")
+    block_map = None
+    block_info = None
+    block_edges = None
+    if args.edges:
+        if not do_extract_from_trace:
+            argParser.error("Edges can only be counted in traces!")
+        if args.incremental or samplings or args.elf is not None:
+            argParser.error("Incompatible arguments: Edges cannot be counted incrementally, in sampled traces or with a binary.")
+    if args.elf is not None:
+        if not do_extract_from_trace or stream:
+            argParser.error("Incompatible arguments: A binary can only be used with a directory of traces.")
+        if args.incremental or samplings:
+            argParser.error("Incompatible arguments: A binary cannot be used with incremental extraction or sampled traces.")
+
+    def cache_dir_for(trace_path):
+        if args.no_cache:
+            return None
+        if args.cache_dir is not None:
+            return args.cache_dir[0]
+        return f"{trace_path}/../cache"
+    cache_size = int(args.cache_size * (1 << 20))
+
+    if args.elf is not None:
+        with report.stage("block_map"):
+            block_map = load_block_map(args.elf[0], cache_dir=cache_dir_for(path), cache_size=cache_size)
+
+    # results are written next to the trace directory (or stream, or extracted basic blocks)
+    if path == '-':
+        output_dir = "."
+    elif do_extract_from_trace and not stream:
+        output_dir = f"{path}/.."
     else:
-        # read basic blocks from csv file
-        basic_blocks = extract_basic_blocks_csv(path)
+        output_dir = os.path.dirname(os.path.abspath(path))
+
+    with report.stage("parse", hot=True) as stage:
+        if do_extract_from_trace and not stream:
+            stage["input_bytes"] = trace_size(path, check_filename)
+        if stream:
+            # build the basic blocks on the fly, the stream is neither stored nor cached
+            if args.edges:
+                basic_blocks, block_edges = extract_basic_blocks_from_stream(path, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, edges=True, stats=stage)
+            else:
+                basic_blocks = extract_basic_blocks_from_stream(path, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, stats=stage)
+        elif block_map is not None:
+            # count the entries of the basic blocks of the binary, their ends are exact
+            basic_blocks, block_info = extract_basic_blocks_with_map(path, check_filename=check_filename, pc_idx=pc_idx, block_map=block_map, delimiter=delimiter, backend=args.backend, jobs=args.jobs, stats=stage)
+        elif samplings:
+            # estimate the basic blocks of the sampled traces, estimates are not cached
+            basic_blocks, intervals = extract_sampled_basic_blocks(path, check_filename=check_filename, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=args.backend, jobs=args.jobs, sampling=args.sampling, stats=stage)
+        elif do_extract_from_trace:
+            if args.edges:
+                # the edges are not cached, so the traces are always parsed
+                basic_blocks, block_edges = extract_basic_blocks_from_traces(path, check_filename=check_filename, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=args.backend, jobs=args.jobs, edges=True, stats=stage)
+            elif args.incremental:
+                # fold newly written trace chunks into the parse state of previous calls
+                basic_blocks = extract_basic_blocks_incremental(path, check_filename=check_filename, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=args.backend, jobs=args.jobs, stats=stage)
+            else:
+                # parse traces and extract basic blocks (unless they are cached)
+                basic_blocks = load_basic_blocks(path, check_filename=check_filename, pc_idx=pc_idx, br_target_idx=br_target_idx, delimiter=delimiter, backend=args.backend, jobs=args.jobs, cache_dir=cache_dir_for(path), cache_size=cache_size, stats=stage)
+        elif is_basic_blocks_db(path):
+            # read basic blocks from binary database, blocks extracted with a binary keep their exact ends
+            basic_blocks, block_info = extract_basic_blocks_db(path, with_block_info=True)
+        else:
+            # read basic blocks from csv file
+            basic_blocks, block_info = extract_basic_blocks_csv(path, with_block_info=True)
+        total_instructions = count_total_instructions(basic_blocks, block_info)
+        stage["basic_blocks"] = len(basic_blocks)
+
+    if do_extract_from_trace:
+        with report.stage("export"):
+            export_basic_blocks(f"{output_dir}/basic_blocks.csv", basic_blocks, block_info)
+            export_basic_blocks_db(f"{output_dir}/basic_blocks.bbdb", basic_blocks, block_info)
+
+    hot_paths = None
+    if block_edges is not None:
+        with report.stage("hot_paths", edges=len(block_edges[1])):
+            hot_paths = rank_superblocks(basic_blocks, block_edges, form_superblocks(basic_blocks, block_edges), block_instruction_counts(basic_blocks, block_info))
+            export_block_edges(f"{output_dir}/basic_block_edges.csv", block_edges)
+            export_superblocks(f"{output_dir}/hot_paths.csv", hot_paths, total_instructions)
 
-    if export_path is None and not args.print:
+    if export_path is None and not args.print and not args.mix:
         # nothing to do
         exit(0)
 
-    total_instructions = count_total_instructions(basic_blocks)
+    asm_index = None
+    if asm_path is not None and (args.asm or args.mix or export_path is not None):
+        with report.stage("asm", hot=True) as stage:
+            asm_index = load_asm_index(asm_path, check_filename=asm_check_filename, pc_idx=asm_pc_idx, asm_idx=asm_idx, delimiter=asm_delimiter, cache_dir=cache_dir_for(asm_path), cache_size=cache_size)
+            stage["instructions"] = len(asm_index)
 
-    cut_off_by_percentage = args.cut_off < 1
+    # without the binary, the instructions of a block are looked up in the assembly index
+    executed_pcs = sorted(asm_index) if asm_index is not None and block_map is None else None
 
-    basic_block_addresses = list(basic_blocks.keys())
-    basic_block_addresses.sort(key=lambda key: key)
-    next_idx = 0
-    total_convered_instruction_count = 0
+    mix = None
+    if args.mix:
+        with report.stage("mix"):
+            mix = instruction_mix(basic_blocks, asm_index, block_info=block_info, block_map=block_map)
+            export_instruction_mix(f"{output_dir}/instruction_mix.csv", mix)
+            export_block_instruction_mix(f"{output_dir}/instruction_mix_blocks.csv", mix)
 
-    # iterate over all basic blocks
-    for bb_start in basic_block_addresses:
-        next_idx += 1
-        call_count = basic_blocks[bb_start]
-        if next_idx >= len(basic_block_addresses):
-            # end of last basic block cannot be determined currently
-            print(f"skipping basic block at '{hex(bb_start)}' (count={call_count})!")
-            continue
-        bb_end  = basic_block_addresses[next_idx] - 4
-        instruction_count = ((bb_end - bb_start) // 4) + 1
-        convered_instruction_count = instruction_count * call_count
-        converd_percentage = (convered_instruction_count / total_instructions)
-        # check number of calls to bb
-        if not cut_off_by_percentage:
-            if call_count < args.cut_off:
+    with report.stage("blocks", basic_blocks=len(basic_blocks)):
+        cut_off_by_percentage = args.cut_off < 1
+
+        basic_block_addresses = list(basic_blocks.keys())
+        basic_block_addresses.sort(key=lambda key: key)
+        next_idx = 0
+        total_convered_instruction_count = 0
+
+        # iterate over all basic blocks
+        for bb_start in basic_block_addresses:
+            next_idx += 1
+            call_count = basic_blocks[bb_start]
+            if block_info is not None:
+                bb_end, instruction_count, symbol = block_info[bb_start]
+            elif next_idx >= len(basic_block_addresses):
+                # end of last basic block cannot be determined without the binary
+                print(f"skipping basic block at '{hex(bb_start)}' (count={call_count})!")
                 continue
-        # check percentage of covered instructions
-        elif converd_percentage < args.cut_off:
-            continue
-        # bb exceeds cut-off
-        total_convered_instruction_count += convered_instruction_count
-        if asm_path is not None:
-            assembly = extract_asm_from_traces(bb_start, instruction_count, asm_path, check_filename=asm_check_filename, pc_idx=asm_pc_idx, asm_idx=asm_idx, delimiter=asm_delimiter)
-        if args.print:
-            print(f'address 0x{bb_start:08x} - 0x{bb_end:08x} | instructions {instruction_count:<4} | count {call_count:<6} ({converd_percentage * 100:.3}%)')
-            if args.asm:
-                for instruction in assembly:
-                    instruction = parse_asm(instruction)
-                    print(f" -> {instruction[0]:<5} {', '.join([f"{r:<8}" for r in instruction[1]])}")
-        if export_path is not None:
-            with open(f"{export_path}/{hex(bb_start)}.txt", 'w') as asm_file:
-                asm_file.write("\n".join(assembly))
+            else:
+                bb_end  = basic_block_addresses[next_idx] - 4
+                instruction_count = ((bb_end - bb_start) // 4) + 1
+                if executed_pcs is not None and not samplings:
+                    # instructions are not necessarily 4 bytes long, the executed ones are exact
+                    addresses = index_addresses(bb_start, basic_block_addresses[next_idx], executed_pcs)
+                    if addresses and None not in addresses:
+                        bb_end, instruction_count = addresses[-1], len(addresses)
+            convered_instruction_count = instruction_count * call_count
+            converd_percentage = (convered_instruction_count / total_instructions)
+            # check number of calls to bb
+            if not cut_off_by_percentage:
+                if call_count < args.cut_off:
+                    continue
+            # check percentage of covered instructions
+            elif converd_percentage < args.cut_off:
+                continue
+            # bb exceeds cut-off
+            total_convered_instruction_count += convered_instruction_count
+            if asm_index is not None and block_info is not None:
+                assembly = extract_asm_from_addresses(block_addresses(bb_start, bb_end, block_map, executed_pcs), asm_index)
+            elif asm_index is not None:
+                # sampled traces do not contain the assembly of every instruction
+                assembly = extract_asm_from_index(bb_start, basic_block_addresses[next_idx], asm_index, executed_pcs, strict=not samplings)
+            if args.print:
+                if intervals is not None:
+                    lower, upper = intervals[bb_start]
+                    print(f'address 0x{bb_start:08x} - 0x{bb_end:08x} | instructions {instruction_count:<4} | count ~{call_count:<6} (95% CI {lower:.0f}-{upper:.0f}) ({converd_percentage * 100:.3}%)')
+                elif block_info is not None:
+                    print(f'address 0x{bb_start:08x} - 0x{bb_end:08x} | instructions {instruction_count:<4} | count {call_count:<6} ({converd_percentage * 100:.3}%) | {symbol}')
+                else:
+                    print(f'address 0x{bb_start:08x} - 0x{bb_end:08x} | instructions {instruction_count:<4} | count {call_count:<6} ({converd_percentage * 100:.3}%)')
+                if args.asm:
+                    for instruction in assembly:
+                        instruction = parse_asm(instruction)
+                        print(f" -> {instruction[0]:<5} {', '.join([f'{r:<8}' for r in instruction[1]])}")
+            if export_path is not None:
+                with open(f"{export_path}/{hex(bb_start)}.txt", 'w') as asm_file:
+                    asm_file.write("\n".join(assembly))
 
     if args.print:
         print(f"-> Basic blocks cover {total_convered_instruction_count} of {total_instructions} instructions ({((total_convered_instruction_count / total_instructions) * 100):.5}%)")
+        if hot_paths is not None:
+            print_hot_paths(hot_paths, total_instructions, args.cut_off)
+        if mix is not None:
+            print_instruction_mix(mix)
+        if samplings:
+            windows = ", ".join(f"window of {window} every {period} instructions" for period, window in sorted(samplings))
+            print(f"-> Counts are estimated from a sampled trace ({windows})")
 
 if __name__ == "__main__":
     main()
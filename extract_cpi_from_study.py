@@ -0,0 +1,152 @@
+import argparse
+import csv
+import json
+import math
+import os
+import re
+
+# Values reported by the simulator in <traces>/<core>/<benchmark>/<benchmark>_log.txt. Logs are appended to by reruns,
+# so the last match of each pattern is used.
+LOG_PATTERNS = {
+    "cpi": re.compile(r'processor cycles per instruction:\s*(\d+(?:\.\d+)?(?:e[+-]?\d+)?)', re.IGNORECASE),
+    "cycles": re.compile(r'processor cycles:\s*(\d+(?:\.\d+)?(?:e[+-]?\d+)?)', re.IGNORECASE),
+    "instructions": re.compile(r'^\s*(?:executed )?instructions(?: executed)?:\s*(\d+)', re.IGNORECASE | re.MULTILINE),
+    "cpu_time": re.compile(r'CPU Time:\s*(\d+(?:\.\d+)?(?:e[+-]?\d+)?)\s*s', re.IGNORECASE),
+    "sim_time": re.compile(r'Simulation Time:\s*(\d+(?:\.\d+)?(?:e[+-]?\d+)?)\s*s', re.IGNORECASE),
+}
+INTEGER_VALUES = ("cycles", "instructions")
+COLUMNS = ["core", "benchmark", *LOG_PATTERNS.keys()]
+
+def parse_study_log(filepath):
+    """ Extracts the values of LOG_PATTERNS from a simulation log, values that are not reported are None """
+    with open(filepath, 'r', errors='replace') as log_file:
+        log = log_file.read()
+    results = {}
+    for name, pattern in LOG_PATTERNS.items():
+        matches = pattern.findall(log)
+        results[name] = None
+        if matches:
+            results[name] = float(matches[-1])
+            if name in INTEGER_VALUES:
+                results[name] = int(results[name])
+    if results["cycles"] is None and results["cpi"] is not None and results["instructions"] is not None:
+        results["cycles"] = round(results["cpi"] * results["instructions"])
+    return results
+
+def collect_study_results(path, cores=None):
+    """ Parses the logs of all (core, benchmark) pairs of a study in a single pass and returns one row per pair """
+    if not os.path.isdir(path):
+        raise ValueError(f"'{path}' is not a valid directory!")
+
+    rows = []
+    for core in sorted(os.listdir(path)):
+        core_path = f"{path}/{core}"
+        if not os.path.isdir(core_path) or (cores is not None and core not in cores):
+            continue
+        for benchmark in sorted(os.listdir(core_path)):
+            log_path = f"{core_path}/{benchmark}/{benchmark}_log.txt"
+            if not os.path.isfile(log_path):
+                continue
+            rows.append({"core": core, "benchmark": benchmark, **parse_study_log(log_path)})
+    return rows
+
+def geometric_mean(values):
+    values = [v for v in values if v is not None and v > 0]
+    if not values:
+        return None
+    return math.exp(sum(math.log(v) for v in values) / len(values))
+
+def compare_cores(rows, baseline=None):
+    """ Creates a benchmark x core CPI table, the ratio of every core to the baseline core and the geometric means across the suite """
+    cores = list(dict.fromkeys(row["core"] for row in rows))
+    if baseline is None and cores:
+        baseline = cores[0]
+    cpi = {}
+    for row in rows:
+        cpi.setdefault(row["benchmark"], {})[row["core"]] = row["cpi"]
+
+    comparison = {"baseline": baseline, "cores": cores, "benchmarks": {}, "geomean": {}}
+    for benchmark, core_cpi in cpi.items():
+        base = core_cpi.get(baseline)
+        comparison["benchmarks"][benchmark] = {
+            core: {
+                "cpi": core_cpi.get(core),
+                "ratio": core_cpi[core] / base if core_cpi.get(core) is not None and base else None,
+            } for core in cores
+        }
+    for core in cores:
+        entries = [benchmark[core] for benchmark in comparison["benchmarks"].values()]
+        comparison["geomean"][core] = {
+            "cpi": geometric_mean([entry["cpi"] for entry in entries]),
+            "ratio": geometric_mean([entry["ratio"] for entry in entries]),
+        }
+    return comparison
+
+def export_results_csv(path, rows):
+    with open(path, 'w', newline='') as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def export_results_json(path, rows, comparison):
+    # columnar layout: one list per column
+    columns = {column: [row[column] for row in rows] for column in COLUMNS}
+    with open(path, 'w') as out_file:
+        json.dump({"columns": columns, "comparison": comparison}, out_file, indent=2)
+
+def print_comparison(comparison):
+    cores = comparison["cores"]
+    others = [core for core in cores if core != comparison["baseline"]]
+    header = f"{'embench':>16}\t" + "\t".join(f"{core.split('_H_')[-1]:<10}" for core in cores)
+    header += "".join(f"\tdiff {core.split('_H_')[-1]:<10}" for core in others)
+    print(header)
+    print("-" * 80)
+
+    def cell(value, spec="<10.5"):
+        return f"{'-':<10}" if value is None else f"{value:{spec}}"
+
+    for benchmark, entries in comparison["benchmarks"].items():
+        line = f"{benchmark:>16}\t" + "\t".join(cell(entries[core]["cpi"]) for core in cores)
+        base = entries[comparison["baseline"]]["cpi"]
+        for core in others:
+            cpi = entries[core]["cpi"]
+            line += "\t     " + cell(None if cpi is None or base is None else cpi - base, "<+10.5")
+        print(line)
+
+    print("-" * 80)
+    line = f"{'geomean':>16}\t" + "\t".join(cell(comparison["geomean"][core]["cpi"]) for core in cores)
+    line += "".join(f"\t   x " + cell(comparison["geomean"][core]["ratio"], "<10.4") for core in others)
+    print(line)
+
+def main():
+
+    def exisiting_dir_type(path):
+        """" Enforces that an argument is a path to a valid location """
+        if os.path.exists(path) and os.path.isdir(path):
+            return path
+        raise argparse.ArgumentTypeError(f"'{path}' is not a valid directory!")
+
+    argParser = argparse.ArgumentParser(description="Aggregates the results of a performance study into a single table.")
+    argParser.add_argument("traces", nargs="?", type=exisiting_dir_type, default="traces", help="Directory of the study (default: %(default)s).")
+    argParser.add_argument("-c", "--cores", nargs="+", help="Cores to compare (default: all cores of the study).")
+    argParser.add_argument("-b", "--baseline", help="Core the other cores are compared to (default: first core).")
+    argParser.add_argument("-o", "--output", default=None, help="Base path of the result files, '.csv' and '.json' are appended (default: <traces>/study_results).")
+    args = argParser.parse_args()
+
+    rows = collect_study_results(args.traces, cores=args.cores)
+    if not rows:
+        argParser.error(f"No simulation logs found in '{args.traces}'!")
+    if args.cores is not None:
+        # keep the order the cores were given in
+        rows.sort(key=lambda row: (args.cores.index(row["core"]), row["benchmark"]))
+    if args.baseline is not None and args.baseline not in {row["core"] for row in rows}:
+        argParser.error(f"Baseline core '{args.baseline}' is not part of the study!")
+
+    comparison = compare_cores(rows, baseline=args.baseline)
+    output = args.output or f"{args.traces}/study_results"
+    export_results_csv(f"{output}.csv", rows)
+    export_results_json(f"{output}.json", rows, comparison)
+    print_comparison(comparison)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import concurrent.futures
+import datetime
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from run_report import RunReport, atomic_write, run_command
+
+WORKSPACE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORES = ["SimpleRISCV_H_nfw_StaBrPred", "SimpleRISCV_H_fw_StaBrPred"]
+EMBENCH_PATH = f"{WORKSPACE}/target_sw/examples/cv32e40p/embench"
+STAGES = ("simulate", "extract")
+
+class StudyManifest:
+    """ Keeps track of the stages that finished for each (core, benchmark) pair, so an interrupted study can be resumed """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.jobs = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as manifest_file:
+                self.jobs = json.load(manifest_file)["jobs"]
+
+    def status(self, core, benchmark, stage):
+        return self.jobs.get(f"{core}/{benchmark}", {}).get(stage, {}).get("status")
+
+    def update(self, core, benchmark, stage, status, attempts):
+        with self.lock:
+            self.jobs.setdefault(f"{core}/{benchmark}", {})[stage] = {
+                "status": status,
+                "attempts": attempts,
+                "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            }
+            with atomic_write(self.path) as temp_path, open(temp_path, 'w') as manifest_file:
+                json.dump({"jobs": self.jobs}, manifest_file, indent=2, sort_keys=True)
+
+def zstd_available():
+    # compression.zstd is part of the standard library since python 3.14, the compression package is missing before
+    if importlib.util.find_spec("compression") is not None and importlib.util.find_spec("compression.zstd") is not None:
+        return True
+    return importlib.util.find_spec("zstandard") is not None
+
+def compress_trace_file(filename, compression):
+    """ Replaces a trace chunk by its gzip or zstd compressed version, extract_basic_blocks.py reads both """
+    suffix = ".gz" if compression == "gzip" else ".zst"
+    with open(filename, 'rb') as in_file, atomic_write(filename + suffix) as temp_filename:
+        if compression == "gzip":
+            with gzip.open(temp_filename, 'wb', compresslevel=6) as out_file:
+                shutil.copyfileobj(in_file, out_file, 1 << 20)
+        else:
+            try:
+                from compression import zstd
+                with zstd.ZstdFile(temp_filename, 'wb') as out_file:
+                    shutil.copyfileobj(in_file, out_file, 1 << 20)
+            except ImportError:
+                import zstandard
+                with open(temp_filename, 'wb') as out_file:
+                    zstandard.ZstdCompressor().copy_stream(in_file, out_file)
+    os.remove(filename)
+
+def compress_traces(trace_path, compression):
+    """ Compresses all uncompressed trace chunks of a (core, benchmark) pair """
+    files = []
+    for trace_dir in (f"{trace_path}/ta", f"{trace_path}/tp"):
+        for filename in sorted(os.listdir(trace_dir)):
+            if not filename.endswith((".gz", ".zst", ".tmp")):
+                files.append(f"{trace_dir}/{filename}")
+    for filename in files:
+        compress_trace_file(filename, compression)
+
+def stage_command(stage, core, benchmark, trace_path, cut_off):
+    """ Returns the command of a study stage, mirrors run_perf_study_for_core.sh """
+    ta_path = f"{trace_path}/ta"
+    tp_path = f"{trace_path}/tp"
+    if stage == "simulate":
+        return [f"{WORKSPACE}/etiss-perf-sim/run_simulator.py", f"{EMBENCH_PATH}/{benchmark}", "--core", core, f"-ta={ta_path}", f"-tp={tp_path}"]
+    export_path = f"{trace_path}/export"
+    return [sys.executable, f"{WORKSPACE}/extract_basic_blocks.py", f"-ta={ta_path}", f"-tp={tp_path}", f"-e={export_path}", f"--elf={EMBENCH_PATH}/{benchmark}", "--mix", "--print", f"--cut-off={cut_off}",
+            f"--report={trace_path}/extract_report.json"]
+
+def run_stage(stage, core, benchmark, args, manifest, report):
+    """ Runs a single stage of a (core, benchmark) pair and retries it if it fails. Every attempt is recorded in the run
+        report. Returns True on success """
+    trace_path = f"{args.traces}/{core}/{benchmark}"
+    log_path = f"{trace_path}/{benchmark}_log.txt"
+    command = stage_command(stage, core, benchmark, trace_path, args.cut_off)
+
+    for attempt in range(1, args.retries + 2):
+        if stage == "simulate":
+            # traces of a failed or interrupted run must not end up in the basic blocks
+            for trace_dir in (f"{trace_path}/ta", f"{trace_path}/tp"):
+                shutil.rmtree(trace_dir, ignore_errors=True)
+                os.makedirs(trace_dir)
+        start = time.perf_counter()
+        with open(log_path, 'a') as log_file:
+            returncode, usage = run_command(command, stdout=log_file, stderr=subprocess.STDOUT)
+        wall_s = time.perf_counter() - start
+        compress_s = None
+        if returncode == 0 and stage == "simulate" and args.compress is not None:
+            compress_traces(trace_path, args.compress)
+            compress_s = time.perf_counter() - start - wall_s
+        report.record_command(stage, command, returncode, usage, wall_s, core=core, benchmark=benchmark, attempt=attempt, compress_s=compress_s)
+        if returncode == 0:
+            manifest.update(core, benchmark, stage, "done", attempt)
+            return True
+        print(f"- {core}/{benchmark}: {stage} failed with exit code {returncode} (attempt {attempt})")
+    manifest.update(core, benchmark, stage, "failed", args.retries + 1)
+    return False
+
+def run_job(core, benchmark, args, manifest, report):
+    """ Runs all missing stages of a (core, benchmark) pair, stops at the first stage that keeps failing """
+    os.makedirs(f"{args.traces}/{core}/{benchmark}", exist_ok=True)
+    for stage in STAGES:
+        if manifest.status(core, benchmark, stage) == "done":
+            continue
+        if not run_stage(stage, core, benchmark, args, manifest, report):
+            return False
+        # later stages have to be redone once an earlier stage was rerun
+        for later_stage in STAGES[STAGES.index(stage) + 1:]:
+            if manifest.status(core, benchmark, later_stage) == "done":
+                manifest.update(core, benchmark, later_stage, "outdated", 0)
+    return True
+
+def main():
+
+    def positive_integer(num):
+        """" Enforces that an argument is a positive integer """
+        num = int(num)
+        if num <= 0:
+            raise argparse.ArgumentTypeError(f"expected positive integer greater than 0!")
+        return num
+
+    argParser = argparse.ArgumentParser(description="Simulates and extracts the basic blocks of every (core, embench) pair in parallel.")
+    argParser.add_argument("cores", nargs="*", default=DEFAULT_CORES, help="Cores to study (default: %(default)s).")
+    argParser.add_argument("-b", "--benchmarks", nargs="+", help="Embench benchmarks to study (default: all).")
+    argParser.add_argument("-j", "--jobs", type=positive_integer, default=os.cpu_count(), help="Number of (core, benchmark) pairs that are processed in parallel (default: number of cores).")
+    argParser.add_argument("-r", "--retries", type=int, default=1, help="How often a failed stage is retried before the pair is skipped.")
+    argParser.add_argument("-t", "--traces", default="traces", help="Directory the traces and logs are written to.")
+    argParser.add_argument("-m", "--manifest", help="Manifest used to resume an interrupted study (default: <traces>/study_manifest.json).")
+    argParser.add_argument("-c", "--cut-off", default="0.02", help="Cut-off passed to extract_basic_blocks.py.")
+    argParser.add_argument("-z", "--compress", choices=["gzip", "zstd"], help="Compresses the trace chunks after each simulation, extract_basic_blocks.py decompresses them while reading.")
+    argParser.add_argument("--report", help="Json file the run report is written to, it records the wall and CPU time, I/O volume and peak RSS of every stage of every pair (default: <traces>/study_report.json). Each extraction writes its own report to <traces>/<core>/<benchmark>/extract_report.json.")
+    argParser.add_argument("--restart", action="store_true", help="If this flag is set, the manifest is ignored and all pairs are processed again.")
+    args = argParser.parse_args()
+
+    if args.compress == "zstd" and not zstd_available():
+        argParser.error("zstd compression requires Python 3.14 or the zstandard package!")
+    for core in args.cores:
+        if not os.path.isfile(f"{WORKSPACE}/etiss-perf-sim/simulator/ini/{core}.ini"):
+            argParser.error(f"Core '{core}' is invalid!")
+    available_benchmarks = sorted(os.listdir(EMBENCH_PATH))
+    benchmarks = available_benchmarks if args.benchmarks is None else args.benchmarks
+    for benchmark in benchmarks:
+        if benchmark not in available_benchmarks:
+            argParser.error(f"Embench '{benchmark}' not found! Available: {', '.join(available_benchmarks)}")
+
+    os.makedirs(args.traces, exist_ok=True)
+    manifest_path = args.manifest or f"{args.traces}/study_manifest.json"
+    if args.restart and os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+    manifest = StudyManifest(manifest_path)
+    report = RunReport("run_perf_study", path=args.report or f"{args.traces}/study_report.json")
+
+    pairs = [(core, benchmark) for core in args.cores for benchmark in benchmarks]
+    pending = [(core, benchmark) for core, benchmark in pairs if any(manifest.status(core, benchmark, stage) != "done" for stage in STAGES)]
+    print(f"Running {len(pending)} of {len(pairs)} (core, benchmark) pairs with {args.jobs} workers...")
+
+    failed = []
+    # the work happens in subprocesses, threads are sufficient to schedule them
+    with report.stage("study", pairs=len(pending), jobs=args.jobs), concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(run_job, core, benchmark, args, manifest, report): (core, benchmark) for core, benchmark in pending}
+        for future in concurrent.futures.as_completed(futures):
+            core, benchmark = futures[future]
+            if future.result():
+                print(f"- {core}/{benchmark}: done")
+            else:
+                failed.append(f"{core}/{benchmark}")
+
+    if failed:
+        print(f"-> {len(failed)} pairs failed and were skipped: {', '.join(sorted(failed))}")
+        print(f"-> Rerun the study to retry them, finished pairs are not processed again.")
+        exit(1)
+    print(f"-> All {len(pairs)} pairs are done!")
+
+if __name__ == "__main__":
+    main()
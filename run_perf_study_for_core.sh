@@ -35,4 +35,4 @@ $workspace/etiss-perf-sim/run_simulator.py $embench_path --core $core -ta=$ta_pa
 
 # extract basic blocks
 export_path="traces/$core/${embench}/export"
-python3 $workspace/extract_basic_blocks.py -ta=$ta_path -tp=$tp_path -e=$export_path --print --cut-off=0.02 | tee -a $log_path
+python3 $workspace/extract_basic_blocks.py -ta=$ta_path -tp=$tp_path -e=$export_path --elf=$embench_path --mix --print --cut-off=0.02 --report="traces/$core/${embench}/extract_report.json" | tee -a $log_path
@@ -0,0 +1,173 @@
+import atexit
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import resource
+import subprocess
+import sys
+import time
+
+# Machine-readable run reports of the workspace scripts. Every stage of a run records its wall and CPU time (including
+# finished child processes), the bytes it read and wrote, the peak RSS so far and optional counters (e.g. rows, from which
+# the throughput is derived). Reports are written to the given path, or to $PSW_RUN_REPORT_DIR if set.
+RUN_REPORT_VERSION = 1
+RUN_REPORT_DIR = "PSW_RUN_REPORT_DIR"
+PROFILE_HOTSPOTS = 20
+
+def io_counters():
+    """ Bytes read and written by this process (including mapped files only where the kernel accounts them). Uses
+        /proc/self/io on Linux, otherwise the block I/O of the resource usage. """
+    try:
+        with open("/proc/self/io", 'r') as io_file:
+            counters = dict(line.split(':') for line in io_file)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_inblock * 512, usage.ru_oublock * 512
+
+def maxrss_mib(maxrss):
+    # ru_maxrss is given in KiB on Linux, but in bytes on macOS
+    return maxrss / (1 << 20) if sys.platform == "darwin" else maxrss / 1024
+
+def rusage_summary(usage):
+    """ Json-serializable summary of a resource usage, e.g. of a child process """
+    return {
+        "cpu_s": usage.ru_utime + usage.ru_stime,
+        "read_bytes": usage.ru_inblock * 512,
+        "write_bytes": usage.ru_oublock * 512,
+        "peak_rss_mib": maxrss_mib(usage.ru_maxrss),
+    }
+
+def run_command(command, **kwargs):
+    """ Runs a command like subprocess.run, but returns (exit code, resource usage of the command and its children) """
+    process = subprocess.Popen(command, **kwargs)
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, rusage_summary(usage)
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """ Yields a temporary path to write instead of path, which replaces path once the block succeeded. Readers never see
+        a partial file, and the temporary name is unique per process, so concurrent runs do not overwrite each other's. """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def report_path(path, name):
+    """ Path the report of a script is written to: the given path, a new file in $PSW_RUN_REPORT_DIR or None """
+    if path is not None:
+        return path
+    report_dir = os.environ.get(RUN_REPORT_DIR)
+    if not report_dir:
+        return None
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{report_dir}/{name}_{timestamp}_{os.getpid()}.json"
+
+class RunReport:
+    """ Collects the stages of a run and writes them as json report when the run ends (also on exit() or errors). Stages
+        that are marked as hot are profiled with cProfile if a profile path is given. """
+
+    def __init__(self, name, path=None, profile=None):
+        self.name = name
+        self.path = report_path(path, name)
+        self.profile_path = profile
+        self.profiler = cProfile.Profile() if profile is not None else None
+        self.stages = []
+        self.commands = []
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self.wall = time.perf_counter()
+        self.cpu = os.times()
+        self.io = io_counters()
+        if self.path is not None or self.profiler is not None:
+            atexit.register(self.write)
+
+    @contextlib.contextmanager
+    def stage(self, name, hot=False, **counters):
+        """ Measures the block as stage. Counters (e.g. rows, input_bytes) can also be added to the yielded stage while it
+            runs, rows are reported per second as well. """
+        stage = {"name": name, **counters}
+        wall, cpu, (read, written) = time.perf_counter(), os.times(), io_counters()
+        profile = hot and self.profiler is not None
+        if profile:
+            self.profiler.enable()
+        try:
+            yield stage
+        except BaseException as e:
+            stage["status"] = "exited" if isinstance(e, SystemExit) and not e.code else "failed"
+            raise
+        finally:
+            if profile:
+                self.profiler.disable()
+            stage.update(self.usage_since(wall, cpu, read, written))
+            if stage.get("rows") is not None and stage["wall_s"] > 0:
+                stage["rows_per_s"] = stage["rows"] / stage["wall_s"]
+            self.stages.append(stage)
+
+    def record_command(self, name, command, returncode, usage, wall_s, **data):
+        """ Records a child process, e.g. the simulator. Its usage is the one returned by run_command. """
+        self.commands.append({"name": name, "command": command if isinstance(command, str) else " ".join(map(str, command)),
+                              "returncode": returncode, "wall_s": wall_s, **usage, **data})
+
+    def run(self, name, command, check=False, **kwargs):
+        """ Runs and records a command, raises CalledProcessError if check is set and it failed. Returns its exit code. """
+        start = time.perf_counter()
+        returncode, usage = run_command(command, **kwargs)
+        self.record_command(name, command, returncode, usage, time.perf_counter() - start)
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+        return returncode
+
+    def usage_since(self, wall, cpu, read, written):
+        now, (now_read, now_written) = os.times(), io_counters()
+        self_usage, children_usage = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            "wall_s": time.perf_counter() - wall,
+            "cpu_s": (now.user + now.system) - (cpu.user + cpu.system),
+            "children_cpu_s": (now.children_user + now.children_system) - (cpu.children_user + cpu.children_system),
+            "read_bytes": now_read - read,
+            "write_bytes": now_written - written,
+            "peak_rss_mib": maxrss_mib(self_usage.ru_maxrss),
+            "children_peak_rss_mib": maxrss_mib(children_usage.ru_maxrss),
+        }
+
+    def hotspots(self):
+        """ Functions with the highest own time in the profiled stages """
+        stats = pstats.Stats(self.profiler)
+        hotspots = []
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            hotspots.append({"function": f"{os.path.basename(filename)}:{line}({function})", "calls": calls, "tottime_s": tottime, "cumtime_s": cumtime})
+        hotspots.sort(key=lambda hotspot: hotspot["tottime_s"], reverse=True)
+        return hotspots[:PROFILE_HOTSPOTS]
+
+    def write(self):
+        report = {
+            "version": RUN_REPORT_VERSION,
+            "script": self.name,
+            "argv": sys.argv,
+            "started": self.started,
+            "total": self.usage_since(self.wall, self.cpu, *self.io),
+            "stages": self.stages,
+            "commands": self.commands,
+        }
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile_path)
+            report["profile"] = {"path": self.profile_path, "hotspots": self.hotspots()}
+        if self.path is None:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with atomic_write(self.path) as temp_path, open(temp_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
@@ -4,4 +4,4 @@ set -e
 
 . $(dirname "${0}")/../.env
 
-${PSW_SCRIPTS_SUPPORT}/code_gen_helper.py $1
+${PSW_SCRIPTS_SUPPORT}/code_gen_helper.py "$@"
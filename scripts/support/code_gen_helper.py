@@ -17,19 +17,155 @@
 # 
 
 import argparse
+import concurrent.futures
+import hashlib
+import json
 import os
-import subprocess
 import pathlib
 import shutil
+import tempfile
+import threading
+import sys
+
+# Run reports (and atomic writes) are shared with the scripts in the workspace root
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[2]))
+from run_report import RunReport, atomic_write
+
+####################################### SUPPORT FUNCTIONS #######################################
+
+STATE_VERSION = 2
+MODEL_CACHE_VERSION = 1
+
+def hashPaths(paths_, suffix_=None, absolute_=True):
+    # Hashes the content and relative location of all files in the given files/directories. Missing paths are hashed as such, so that they are detected as changed
+    # Without absolute_, the hash does not depend on where the paths are located (e.g. in which workspace)
+    hash_ = hashlib.sha256()
+    for path_i in paths_:
+        path_i = pathlib.Path(path_i)
+        if absolute_:
+            hash_.update(("path:" + str(path_i) + "\n").encode())
+        if path_i.is_file():
+            files = [path_i]
+        elif path_i.is_dir():
+            files = sorted(f for f in path_i.rglob("*") if f.is_file() and not any(part in ["venv", "__pycache__"] or part.startswith(".") for part in f.relative_to(path_i).parts))
+        else:
+            hash_.update(b"missing\n")
+            continue
+        for file_i in files:
+            if suffix_ is not None and file_i.suffix != suffix_:
+                continue
+            hash_.update((str(file_i.relative_to(path_i) if file_i != path_i else file_i.name) + "\n").encode())
+            hash_.update(hashlib.sha256(file_i.read_bytes()).digest())
+    return hash_.hexdigest()
+
+def fileTimes(dir_):
+    # Modification times of all files below a directory, to find the files written by an external tool
+    dir_ = pathlib.Path(dir_)
+    return {f: f.stat().st_mtime_ns for f in dir_.rglob("*") if f.is_file()} if dir_.is_dir() else {}
+
+def changedFiles(dir_, before_):
+    # Files below a directory that were written since fileTimes() returned before_
+    return [str(f) for f, mtime_i in sorted(fileTimes(dir_).items()) if before_.get(f) != mtime_i]
+
+def sharedLibraries(dir_):
+    # Shared libraries below a directory (e.g. the installed ETISS and its plugins), skipping the same directories as hashPaths
+    dir_ = pathlib.Path(dir_)
+    return [str(f) for f in sorted(dir_.rglob("*")) if f.is_file() and ".so" in f.suffixes and not any(part in ["venv", "__pycache__"] or part.startswith(".") for part in f.relative_to(dir_).parts)]
+
+def generatorVersion(generatorDir_):
+    # Generators are identified by their python sources, so that local changes to a generator are detected as well
+    return hashPaths([generatorDir_], ".py", absolute_=False)
+
+def modelCacheDir():
+    # M2ISAR-models are cached per machine, so that all workspaces share them
+    cacheHome = os.environ.get("XDG_CACHE_HOME", str(pathlib.Path.home() / ".cache"))
+    return pathlib.Path(os.environ.get("PSW_M2ISAR_MODEL_CACHE", cacheHome + "/psw/m2isar_models"))
+
+def lookupModel(cacheDir_, key_):
+    # Returns the cached model directory, or None if there is no (consistent) entry. Entries whose files do not match their manifest are removed
+    entry = cacheDir_ / key_
+    try:
+        manifest = json.loads((entry / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return None
+    modelDir = entry / "model"
+    files = sorted(str(f.relative_to(modelDir)) for f in modelDir.rglob("*") if f.is_file()) if modelDir.is_dir() else []
+    if manifest.get("version") != MODEL_CACHE_VERSION or sorted(manifest.get("files", {})) != files or \
+            any(hashlib.sha256((modelDir / f).read_bytes()).hexdigest() != manifest["files"][f] for f in files):
+        print("Removing inconsistent M2ISAR-model cache entry: " + str(entry))
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+    return modelDir
+
+def storeModel(cacheDir_, key_, modelDir_):
+    # Copies a model directory into the cache. The entry is prepared in a temp directory and renamed, so that concurrent runs never see partial entries
+    cacheDir_.mkdir(parents=True, exist_ok=True)
+    tempEntry = pathlib.Path(tempfile.mkdtemp(prefix=key_ + ".", dir=cacheDir_))
+    shutil.copytree(modelDir_, tempEntry / "model")
+    files = {str(f.relative_to(tempEntry / "model")): hashlib.sha256(f.read_bytes()).hexdigest() for f in (tempEntry / "model").rglob("*") if f.is_file()}
+    (tempEntry / "manifest.json").write_text(json.dumps({"version": MODEL_CACHE_VERSION, "files": files}, indent=2, sort_keys=True))
+    entry = cacheDir_ / key_
+    if entry.exists():
+        shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.rename(tempEntry, entry)
+    except OSError:
+        # another run stored the same model in the meantime
+        shutil.rmtree(tempEntry, ignore_errors=True)
+
+class StageState:
+    # Records the input and output hashes of each code generation stage, so that a stage is skipped if neither changed since its last successful run
+
+    def __init__(self, path_, force_):
+        self.path = path_
+        self.stages = {}
+        if path_.is_file() and not force_:
+            try:
+                state = json.loads(path_.read_text())
+                if state.get("version") == STATE_VERSION:
+                    self.stages = state["stages"]
+            except (ValueError, KeyError):
+                print("Ignoring corrupt code generation state: " + str(path_))
+
+    def isUpToDate(self, stage_, inputs_, outputs_):
+        entry = self.stages.get(stage_)
+        return entry is not None and entry["inputs"] == inputs_ and entry["outputs"] == hashPaths(outputs_)
+
+    def get(self, stage_, key_, default_=None):
+        return self.stages.get(stage_, {}).get(key_, default_)
+
+    def record(self, stage_, inputs_, outputs_, **data_):
+        self.stages[stage_] = {"inputs": inputs_, "outputs": hashPaths(outputs_), **data_}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.path) as tempPath:
+            pathlib.Path(tempPath).write_text(json.dumps({"version": STATE_VERSION, "stages": self.stages}, indent=2, sort_keys=True))
+
+    def invalidate(self, stage_):
+        self.stages.pop(stage_, None)
+
+def combineHashes(*hashes_):
+    return hashlib.sha256("\n".join(hashes_).encode()).hexdigest()
 
 ####################################### INPUT ARGUMENT PARSING  #######################################
 
 argParser = argparse.ArgumentParser()
 argParser.add_argument("inputDescription", help="Input description. Supported formats are .json(monitor description) or .corePerfDsl (performance model)")
 argParser.add_argument("-i", "--info_print", action="store_true", help="Run M2ISAR-Perf with info prints enabled")
+argParser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of monitor generation jobs that run concurrently (default: number of cores), variants are always deployed one after another")
+argParser.add_argument("-f", "--force", action="store_true", help="Run all stages, even if their inputs did not change since the last run")
+argParser.add_argument("--report", help="Json file the run report (wall and CPU time, I/O volume and peak RSS of every stage and generator call) is written to (default: code_gen_report.json next to the code generation state)")
 args = argParser.parse_args()
 inputFile = pathlib.Path(args.inputDescription).resolve()
 
+# Input and output hashes of previous runs (see StageState)
+stageState = StageState(pathlib.Path(os.environ.get("PSW_TEMP_M2ISAR_MODEL")).resolve().parent / "code_gen_state.json", args.force)
+report = RunReport("code_gen_helper", path=args.report or str(stageState.path.parent / "code_gen_report.json"))
+m2isarVersion = generatorVersion(os.environ.get("PSW_M2ISAR"))
+
+# Concurrent jobs create their own temp directories in here
+tempRoot = pathlib.Path(__file__).parent / "temp"
+tempRoot.mkdir(parents=True, exist_ok=True)
+
 
 ####################################### PARSING CORE-DSL WITH M2ISAR #######################################
 
@@ -39,17 +175,33 @@ m2isarModel = None
 # NOTE: Currently hard-coded to use default ETISS CoreDSL
 coreDsl = os.environ.get("PSW_DEFAULT_CORE_DSL")
 
-# Calling M2ISAR to parse CoreDSL description
-m2isar_run = os.environ.get("PSW_SCRIPTS_SUPPORT") + "/m2isar_run_wrapper.sh"
-subprocess.run([m2isar_run, "coredsl2_parser", coreDsl], check=True)
-
-# Move generated M2ISAR-model to intermediate directory
 coreDsl_dir = pathlib.Path(coreDsl).resolve().parent
-genModel_dir = coreDsl_dir / "gen_model"
 m2isarModel_dir = pathlib.Path(os.environ.get("PSW_TEMP_M2ISAR_MODEL")).resolve() / coreDsl_dir.name
-m2isarModel_dir.mkdir(parents=True, exist_ok=True)
-shutil.copytree(genModel_dir, m2isarModel_dir, dirs_exist_ok=True)
-shutil.rmtree(genModel_dir)
+
+# Skip parsing, if neither the CoreDSL sources nor M2ISAR changed
+parseInputs = combineHashes(hashPaths([coreDsl_dir]), coreDsl, m2isarVersion)
+# The model cache is keyed independent of the workspace location: CoreDSL sources, the parsed top file and M2ISAR
+modelKey = combineHashes(str(MODEL_CACHE_VERSION), hashPaths([coreDsl_dir], absolute_=False), pathlib.Path(coreDsl).name, m2isarVersion)
+with report.stage("parse"):
+    if stageState.isUpToDate("parse", parseInputs, [m2isarModel_dir]):
+        print("CoreDSL unchanged, skipping M2ISAR parsing")
+    elif not args.force and (cachedModel_dir := lookupModel(modelCacheDir(), modelKey)) is not None:
+        print("Using cached M2ISAR-model: " + str(cachedModel_dir))
+        shutil.rmtree(m2isarModel_dir, ignore_errors=True)
+        shutil.copytree(cachedModel_dir, m2isarModel_dir)
+        stageState.record("parse", parseInputs, [m2isarModel_dir])
+    else:
+        # Calling M2ISAR to parse CoreDSL description
+        m2isar_run = os.environ.get("PSW_SCRIPTS_SUPPORT") + "/m2isar_run_wrapper.sh"
+        report.run("coredsl2_parser", [m2isar_run, "coredsl2_parser", coreDsl], check=True)
+
+        # Move generated M2ISAR-model to intermediate directory
+        genModel_dir = coreDsl_dir / "gen_model"
+        m2isarModel_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copytree(genModel_dir, m2isarModel_dir, dirs_exist_ok=True)
+        storeModel(modelCacheDir(), modelKey, genModel_dir)
+        shutil.rmtree(genModel_dir)
+        stageState.record("parse", parseInputs, [m2isarModel_dir])
 
 # Extract M2ISAR-model
 modelCnt = 0
@@ -68,34 +220,49 @@ if modelCnt > 1:
 monitorDescriptionList = []
 
 # Only if input description is of type .corePerfDsl
+# The description may import further files of its directory, so all of them are part of the inputs
+perfInputs = None
 if inputFile.suffix == ".corePerfDsl":
-
-    m2isar_perf_run = os.environ.get("PSW_SCRIPTS_SUPPORT") + "/m2isar_perf_run_wrapper.sh"
-
-    # Generate estimator models (with or without info prints)
-    flags = "-c"
-    if args.info_print:
-        flags += " -i"
-    subprocess.run([m2isar_perf_run, str(inputFile), flags, ("-o=" + os.environ.get("PSW_CODE_GEN_OUT"))], check=True)
-
-    # Generate monitor description (Need to store in temp directory, to keep track of which descriptions were generated this run. Will be deleted afterwards)
-    dumpDir = pathlib.Path(__file__).parent/ "temp"
-    subprocess.run([m2isar_perf_run, str(inputFile), "-m", ("-o=" + str(dumpDir))], check=True)
-
-    # Extract monitor description and copy them to intermediate directory
-    intermDir_monitor = pathlib.Path(os.environ.get("PSW_TEMP_MONITOR_DESCRIPTION")).resolve()
-    for subDir_i in dumpDir.iterdir():
-        if subDir_i.is_dir():
-            monitor_dir = intermDir_monitor / subDir_i.name
-            monitor_dir.mkdir(parents=True, exist_ok=True)
-            for file_i in subDir_i.iterdir():
-                if file_i.is_file() and (file_i.suffix == ".json"):
-                    monitor_file = monitor_dir / file_i.name
-                    shutil.copy(file_i, monitor_file)
-                    monitorDescriptionList.append(monitor_file)
-
-    # Remove temp dir
-    shutil.rmtree(dumpDir)
+    perfInputs = combineHashes(hashPaths([inputFile.parent]), str(inputFile), str(args.info_print), generatorVersion(os.environ.get("PSW_M2ISAR_PERF")))
+    perfOutputs = stageState.get("perf_model", "monitors", []) + stageState.get("perf_model", "files", [])
+    if stageState.isUpToDate("perf_model", perfInputs, perfOutputs):
+        print("Performance model unchanged, skipping M2ISAR-Perf code generation")
+        monitorDescriptionList = [pathlib.Path(f) for f in stageState.get("perf_model", "monitors")]
+
+if inputFile.suffix == ".corePerfDsl" and not monitorDescriptionList:
+
+    with report.stage("perf_model"):
+        m2isar_perf_run = os.environ.get("PSW_SCRIPTS_SUPPORT") + "/m2isar_perf_run_wrapper.sh"
+
+        # Generate estimator models (with or without info prints)
+        # Files written to the output directory by this call are recorded as outputs of the stage
+        codeGenOut = pathlib.Path(os.environ.get("PSW_CODE_GEN_OUT"))
+        codeGenBefore = fileTimes(codeGenOut)
+        flags = "-c"
+        if args.info_print:
+            flags += " -i"
+        report.run("perf_model", [m2isar_perf_run, str(inputFile), flags, ("-o=" + os.environ.get("PSW_CODE_GEN_OUT"))], check=True)
+
+        # Generate monitor description (Need to store in temp directory, to keep track of which descriptions were generated this run. Will be deleted afterwards)
+        dumpDir = pathlib.Path(tempfile.mkdtemp(prefix="m2isar_perf_", dir=tempRoot))
+        report.run("monitor_description", [m2isar_perf_run, str(inputFile), "-m", ("-o=" + str(dumpDir))], check=True)
+
+        # Extract monitor description and copy them to intermediate directory
+        intermDir_monitor = pathlib.Path(os.environ.get("PSW_TEMP_MONITOR_DESCRIPTION")).resolve()
+        for subDir_i in dumpDir.iterdir():
+            if subDir_i.is_dir():
+                monitor_dir = intermDir_monitor / subDir_i.name
+                monitor_dir.mkdir(parents=True, exist_ok=True)
+                for file_i in subDir_i.iterdir():
+                    if file_i.is_file() and (file_i.suffix == ".json"):
+                        monitor_file = monitor_dir / file_i.name
+                        shutil.copy(file_i, monitor_file)
+                        monitorDescriptionList.append(monitor_file)
+
+        # Remove temp dir
+        shutil.rmtree(dumpDir)
+        perfFiles = changedFiles(codeGenOut, codeGenBefore)
+        stageState.record("perf_model", perfInputs, monitorDescriptionList + perfFiles, monitors=[str(f) for f in monitorDescriptionList], files=perfFiles)
 
 ####################################### MONITOR GENERATION WITH M2ISAR #######################################
 
@@ -119,35 +286,61 @@ if m2isarModel == None:
 # a) to keep track on which models were generated
 # b) as a temp work-around, as long as the output directory format of M2ISAR trace_gen is not aligned to M2ISAR-Perf's
 # Temp directory will be removed afterwards
-dumpDir = pathlib.Path(__file__).parent / "temp"
-dumpDir.mkdir(parents=True, exist_ok=True)
+# Each monitor is a separate stage, so that only monitors whose description (or the M2ISAR-model) changed are regenerated
+# Monitors are generated concurrently, each job uses its own temp directory
+m2isarModelHash = hashPaths([m2isarModel])
 m2isar_run = os.environ.get("PSW_SCRIPTS_SUPPORT") + "/m2isar_run_wrapper.sh"
-for monitor_i in monitorDescriptionList:
-    subprocess.run([m2isar_run, "trace_gen", str(monitor_i), str(m2isarModel), ("-o=" + str(dumpDir))],check=True)
-
-# change dumpDir to dumpDir/code
-dumpDir = dumpDir / "code"
-
-# # Extract generated variant files (e.g.: CV32E40P) and copy them to output directory
-for tempVar_i in dumpDir.iterdir():
-    if tempVar_i.is_dir():
-
-        # Check if output directoryfor this variant exists. If not, generate
-        variantDir = pathlib.Path(os.environ.get("PSW_CODE_GEN_OUT")) / tempVar_i.name 
-        outDir = variantDir / "code"
-        if not outDir.is_dir():
-            outDir.mkdir(parents=True)
-
-        # Add variantDir to hand-over item
-        variantDirList.append(variantDir)
-
-        # Copy the generated module files (e.g. monitor) to the target variant dir
-        for tempMod_i in tempVar_i.iterdir():
-            if tempMod_i.is_dir():
-                shutil.copytree(tempMod_i, (outDir / tempMod_i.name), dirs_exist_ok=True)
+copyLock = threading.Lock()
+
+def generateMonitor(monitor_i, monitorInputs):
+    # Returns the variant dirs and the output files of a monitor description
+    dumpDir = pathlib.Path(tempfile.mkdtemp(prefix="trace_gen_", dir=tempRoot))
+    report.run("trace_gen", [m2isar_run, "trace_gen", str(monitor_i), str(m2isarModel), ("-o=" + str(dumpDir))], check=True)
+
+    # # Extract generated variant files (e.g.: CV32E40P) and copy them to output directory
+    monitorVariants = []
+    monitorFiles = []
+    with copyLock:
+        for tempVar_i in (dumpDir / "code").iterdir():
+            if tempVar_i.is_dir():
+
+                # Check if output directoryfor this variant exists. If not, generate
+                variantDir = pathlib.Path(os.environ.get("PSW_CODE_GEN_OUT")) / tempVar_i.name 
+                outDir = variantDir / "code"
+                if not outDir.is_dir():
+                    outDir.mkdir(parents=True)
+                monitorVariants.append(str(variantDir))
+
+                # Copy the generated module files (e.g. monitor) to the target variant dir
+                for tempMod_i in tempVar_i.iterdir():
+                    if tempMod_i.is_dir():
+                        shutil.copytree(tempMod_i, (outDir / tempMod_i.name), dirs_exist_ok=True)
+                        monitorFiles.extend(str(outDir / tempMod_i.name / f.relative_to(tempMod_i)) for f in sorted(tempMod_i.rglob("*")) if f.is_file())
+
+    # Remove temp directory
+    shutil.rmtree(dumpDir)
+    return monitorVariants, monitorFiles
 
-# Remove temp directory
-shutil.rmtree(dumpDir)
+monitorJobs = {}
+for monitor_i in monitorDescriptionList:
+    monitorStage = "monitor:" + str(monitor_i)
+    monitorInputs = combineHashes(hashPaths([monitor_i]), m2isarModelHash, m2isarVersion)
+    if stageState.isUpToDate(monitorStage, monitorInputs, stageState.get(monitorStage, "files", [])):
+        print("Monitor description unchanged, skipping monitor generation: " + monitor_i.name)
+        continue
+    monitorJobs[monitor_i] = monitorInputs
+
+with report.stage("monitors", jobs=len(monitorJobs)), concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    futures = {monitor_i: executor.submit(generateMonitor, monitor_i, monitorInputs) for monitor_i, monitorInputs in monitorJobs.items()}
+    for monitor_i, future_i in futures.items():
+        monitorVariants, monitorFiles = future_i.result()
+        stageState.record("monitor:" + str(monitor_i), monitorJobs[monitor_i], monitorFiles, variants=monitorVariants, files=monitorFiles)
+
+# Add variantDirs to hand-over item, in the order of the monitor descriptions
+for monitor_i in monitorDescriptionList:
+    for variant_i in stageState.get("monitor:" + str(monitor_i), "variants"):
+        if pathlib.Path(variant_i) not in variantDirList:
+            variantDirList.append(pathlib.Path(variant_i))
 
 # m2isar_run = os.environ.get("PSW_SCRIPTS_SUPPORT") + "/m2isar_run_wrapper.sh"
 # for monitor_i in monitorDescriptionList:
@@ -161,15 +354,45 @@ if not variantDirList:
 
 deploy_run = os.environ.get("PSW_SCRIPTS_SUPPORT") + "/deploy_SWEvalLib.py"
 
+# A variant is only deployed again if its generated code (perf-model and monitors) changed, or if its deployed files in SoftwareEvalLib changed (e.g. by a submodule update or clean)
+swEvalLib = pathlib.Path(os.environ.get("PSW_SWEVAL_LIB"))
+deployJobs = {}
 for variant_i in variantDirList:
-    print("Deploying: " + variant_i.name)
-    subprocess.run([deploy_run, variant_i], check=True)
+    deployStage = "deploy:" + str(variant_i)
+    deployInputs = combineHashes(hashPaths([variant_i / "code"]), hashPaths([pathlib.Path(deploy_run)]))
+    if stageState.isUpToDate(deployStage, deployInputs, stageState.get(deployStage, "files", [])):
+        print("Variant unchanged, skipping deployment: " + variant_i.name)
+        continue
+    deployJobs[variant_i] = deployInputs
+
+if deployJobs:
+    # ETISS has to be rebuilt, even if this run is interrupted before the rebuild
+    stageState.invalidate("rebuild")
+
+# Variants are deployed one after another, as the deploy scripts update shared files of SoftwareEvalLib (read-modify-write)
+# The deploy scripts copy the generated files into SoftwareEvalLib, so files written there during the deployment of a variant with the name of one of its files are its outputs
+with report.stage("deploy", jobs=len(deployJobs)):
+    for variant_i, deployInputs in deployJobs.items():
+        print("Deploying: " + variant_i.name)
+        swEvalLibBefore = fileTimes(swEvalLib)
+        report.run("deploy", [deploy_run, variant_i], check=True)
+        variantNames = {f.name for f in (variant_i / "code").rglob("*") if f.is_file()}
+        deployFiles = [f for f in changedFiles(swEvalLib, swEvalLibBefore) if pathlib.Path(f).name in variantNames]
+        stageState.record("deploy:" + str(variant_i), deployInputs, deployFiles, files=deployFiles)
 
 
 ####################################### RE_BUILD ETISS #######################################
 
-rebuild_run = os.environ.get("PSW_PERF_SIM") + "/rebuild.sh"
-subprocess.run([rebuild_run], check=True)
+# Rebuild only if any variant was deployed since the last successful rebuild, or if the built libraries (ETISS and its plugins) changed or are missing (e.g. a wiped build dir)
+rebuildInputs = combineHashes(*sorted(stageState.get(stage_i, "inputs") for stage_i in stageState.stages if stage_i.startswith("deploy:")))
+with report.stage("rebuild"):
+    if stageState.isUpToDate("rebuild", rebuildInputs, stageState.get("rebuild", "files", [])):
+        print("No variant deployed, skipping ETISS rebuild")
+    else:
+        rebuild_run = os.environ.get("PSW_PERF_SIM") + "/rebuild.sh"
+        report.run("rebuild", [rebuild_run], check=True)
+        rebuildFiles = sharedLibraries(os.environ.get("PSW_PERF_SIM"))
+        stageState.record("rebuild", rebuildInputs, rebuildFiles, files=rebuildFiles)
 
 ## change directory to etiss-perf-sim/etiss/build_dir/
 #os.chdir(os.environ.get("PSW_PERF_SIM") + "/etiss/build_dir/")
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import pathlib
 import sys
 
+# Run reports are shared with the scripts in the workspace root
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[2]))
+from run_report import RunReport
+
 # Read input arguments
 argParser = argparse.ArgumentParser()
 argParser.add_argument("targetSW", help="Target software handle (e.g.: dhry, em:cubic)")
 argParser.add_argument("-c", "--core", help="Target core architecture [cv32e40p | cva6]")
+argParser.add_argument("--report", help="Json file the run report (wall and CPU time, I/O volume and peak RSS of the simulator) is written to. Defaults to a new file in $PSW_RUN_REPORT_DIR if set")
 args, args_passThrough = argParser.parse_known_args()
 
 sim_args = ""
@@ -52,5 +58,6 @@ simulator = os.environ.get("PSW_PERF_SIM")
 exe = simulator + "/run_simulator.py " + targetSW + sim_args
 for arg_i in args_passThrough:
    exe += " " + arg_i
-   
-os.system(exe)
+
+report = RunReport("run_helper", path=args.report)
+report.run("simulate", exe, shell=True)
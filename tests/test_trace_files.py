@@ -0,0 +1,65 @@
+import json
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from binary_trace import BinaryTrace, convert_text_trace, trace_layout
+from extract_basic_blocks import extract_basic_blocks_from_traces, extract_sampled_basic_blocks, find_trace_files
+
+DESCRIPTION = pathlib.Path(__file__).resolve().parents[1] / "code_gen/descriptions/monitor_descriptions/InstructionTrace_RV32IM_Zicsr.json"
+HEADER = "pc,code,assembly,imm,rs1_data,rs2_data,rd_data,jump_pc,csr,csr_reg,mem_addr\n"
+
+def write_text_traces(path, chunks):
+    """ Writes instruction trace chunks, every chunk is a list of (pc, branch target or None) """
+    path.mkdir()
+    for idx, chunk in enumerate(chunks):
+        rows = [f"{pc:x},00000013,addi,0,0,0,0,{'-' if target is None else f'{target:x}'},,,\n" for pc, target in chunk]
+        (path / f"instr_trace_{idx}.txt").write_text(HEADER + "".join(rows))
+
+def is_instr_trace(filename):
+    return filename.endswith((".txt", ".bin")) and "instr_trace_" in filename
+
+def loop_chunks(iterations):
+    """ A loop of three instructions that is split across chunks, so that blocks continue in the next chunk """
+    rows = []
+    for _ in range(iterations):
+        rows += [(0x80000000, None), (0x80000004, None), (0x80000008, 0x80000000)]
+    rows.append((0x8000000c, None))
+    return [rows[start:start + 4] for start in range(0, len(rows), 4)]
+
+def test_converted_traces_are_read_once(tmp_path):
+    chunks = loop_chunks(10)
+    write_text_traces(tmp_path / "text", chunks)
+    write_text_traces(tmp_path / "mixed", chunks)
+    layout = trace_layout(json.loads(DESCRIPTION.read_text()))
+    # only some chunks are converted, the text traces are kept next to them
+    for idx in (0, 2):
+        convert_text_trace(str(tmp_path / "mixed" / f"instr_trace_{idx}.txt"), str(tmp_path / "mixed" / f"instr_trace_{idx}.bin"), layout, ",")
+
+    files = [pathlib.Path(f).name for f in find_trace_files(str(tmp_path / "mixed"), is_instr_trace)]
+    assert files == [pathlib.Path(f"instr_trace_{idx}").with_suffix(".bin" if idx in (0, 2) else ".txt").name for idx in range(len(chunks))]
+
+    expected = extract_basic_blocks_from_traces(str(tmp_path / "text"), is_instr_trace, pc_idx=0, br_target_idx=7)
+    assert expected == {0x80000000: 10, 0x8000000c: 1}
+    assert extract_basic_blocks_from_traces(str(tmp_path / "mixed"), is_instr_trace, pc_idx=0, br_target_idx=7) == expected
+
+def test_sampling_continues_across_chunks(tmp_path):
+    chunks = loop_chunks(10)
+    write_text_traces(tmp_path / "sampled", chunks)
+    # blank lines are no instructions
+    with open(tmp_path / "sampled" / "instr_trace_0.txt", 'a') as trace_file:
+        trace_file.write("\n")
+    layout = trace_layout(json.loads(DESCRIPTION.read_text()))
+    row = 0
+    for idx in range(len(chunks) - 1):
+        row = convert_text_trace(str(tmp_path / "sampled" / f"instr_trace_{idx}.txt"), str(tmp_path / "sampled" / f"instr_trace_{idx}.bin"), layout, ",", sampling=(3, 1), row=row)
+    assert row == sum(len(chunk) for chunk in chunks[:-1])
+
+    with BinaryTrace(str(tmp_path / "sampled" / "instr_trace_0.bin")) as trace:
+        assert trace.sampling == (3, 1)
+        # every third instruction of the loop, i.e. always its first one
+        assert {pc for _, pc in trace.iter_fields(0)} == {0x80000000}
+
+    # the last chunk (0x80000004, 0x80000008, 0x8000000c) is not converted and must not be scaled up
+    basic_blocks, _ = extract_sampled_basic_blocks(str(tmp_path / "sampled"), is_instr_trace, pc_idx=0, br_target_idx=7)
+    assert basic_blocks == {0x80000000: round((10 * 3 + 2) / 3), 0x8000000c: 1}